@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Reproducible benchmarks of every stage and method of `GeoIpMap`.
+
+A synthetic database and IP list are generated with a fixed seed, and
+the time of every stage (load, lookup, projection and render) is written
+as JSON, so the results of two commits can be compared:
+
+    $ python benchmark.py run -o old.json
+    $ python benchmark.py run -o new.json
+    $ python benchmark.py compare old.json new.json
+"""
+
+import argparse
+import datetime
+from geoipmap import GeoImage
+from geoipmap import GeoIndex
+from geoipmap import GeoIpMap
+from geoipmap import GeoRaster
+from geoipmap.geosynth import synth_geodb
+from geoipmap.geosynth import synth_ips
+from geoipmap.ipparse import parse_ips
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+
+METHODS = ('raw', 'threading', 'multiprocessing', 'merge')
+
+
+def measure(function, repeat):
+    """Runs a function several times and returns the elapsed times.
+
+    :param function: Function with no arguments
+    :type function: callable
+    :param repeat: Number of runs
+    :type repeat: int
+    :return: Elapsed time of every run, in seconds
+    :rtype: list
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def git_commit():
+    """Returns the current commit, if the program is in a repository."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Generates the data and measures every stage and method."""
+    results = {}
+
+    def record(name, runs):
+        results[name] = {'seconds': min(runs), 'runs': runs}
+        print('{:<24} {:10.4f} s'.format(name, min(runs)), file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, 'geodb.csv')
+        idx_file = os.path.join(tmp, 'geodb.idx')
+        ips_file = os.path.join(tmp, 'ips.lst')
+        img_file = os.path.join(tmp, 'map.png')
+
+        print('Generating {} networks and {} IPs'
+              .format(args.networks, args.ips), file=sys.stderr)
+        synth_geodb(csv_file, args.networks, args.seed)
+        synth_ips(ips_file, args.ips, args.networks, args.seed)
+        GeoRaster.save(np.full((args.height, args.width, 4), 255,
+                               dtype=np.uint8), img_file)
+        img = GeoImage(img_file, args.width, args.height, s_deg=-82)
+
+        # Load
+        record('load.csv', measure(lambda: GeoIndex.from_csv(csv_file),
+                                   args.repeat))
+        index = GeoIndex.from_csv(csv_file)
+        record('compile', measure(lambda: index.save(idx_file), args.repeat))
+        record('coalesce', measure(lambda: index.coalesce(img), args.repeat))
+        record('load.compiled', measure(lambda: GeoIndex.load(idx_file),
+                                        args.repeat))
+        with open(ips_file, 'rt') as f:
+            lines = f.readlines()
+        record('load.ips', measure(lambda: parse_ips(lines), args.repeat))
+
+        # Lookup, by method (the merge method reads the CSV)
+        for method in args.methods:
+            geo = GeoIpMap(ips_file, csv_file if method == 'merge'
+                           else idx_file, img, method=method,
+                           num_workers=args.workers, num_splits=args.workers)
+            record('lookup.' + method, measure(geo.ips_to_pixels,
+                                               args.repeat))
+
+        # Projection and render
+        geo = GeoIpMap(ips_file, idx_file, img, method='raw')
+        _, lats, lons, _, _ = geo.locations()
+        record('projection', measure(lambda: img.geo_to_pixels(lats, lons),
+                                     args.repeat))
+        geo.ips_to_pixels()
+        raster = GeoRaster(img)
+        record('render.decode',
+               measure(lambda: GeoRaster(img).base, args.repeat))
+        buf = raster.render(geo.pixels)
+        record('render', measure(lambda: raster.render(geo.pixels),
+                                 args.repeat))
+        out_file = os.path.join(tmp, 'out.png')
+        record('render.save', measure(lambda: raster.save(buf, out_file),
+                                      args.repeat))
+
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': multiprocessing.cpu_count(),
+        'params': {'networks': args.networks, 'ips': args.ips,
+                   'seed': args.seed, 'workers': args.workers,
+                   'width': args.width, 'height': args.height,
+                   'repeat': args.repeat},
+        'results': results,
+    }
+
+
+def compare(old, new, tolerance, min_delta=0.005):
+    """Compares two results and prints the stages that got slower.
+
+    The differences smaller than `min_delta` seconds are not considered
+    slowdowns, since they are within the noise of the measurements.
+
+    :param old: Results of the reference run
+    :type old: dict
+    :param new: Results of the run to check
+    :type new: dict
+    :param tolerance: Allowed relative slowdown (0.1 is 10%)
+    :type tolerance: float
+    :param min_delta: Allowed absolute slowdown, in seconds
+    :type min_delta: float
+    :return: Names of the stages slower than the tolerance
+    :rtype: list
+    """
+    if old['params'] != new['params']:
+        print('Warning: the parameters of the runs differ', file=sys.stderr)
+
+    regressions = []
+    print('{:<24} {:>10} {:>10} {:>8}'.format('stage', 'old (s)', 'new (s)',
+                                              'ratio'))
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['seconds']
+        after = result['seconds']
+        ratio = after / before if before else float('inf')
+        slower = ratio > 1 + tolerance and after - before > min_delta
+        if slower:
+            regressions.append(name)
+        print('{:<24} {:10.4f} {:10.4f} {:8.2f}{}'.format(
+            name, before, after, ratio, '  <-- slower' if slower else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark GeoIpMap with \
+                                                  synthetic data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks")
+    run_parser.add_argument('-N', '--networks', type=int, default=1000000,
+                            help="Number of networks of the database")
+    run_parser.add_argument('-I', '--ips', type=int, default=100000,
+                            help="Number of IPs of the list")
+    run_parser.add_argument('-s', '--seed', type=int, default=0,
+                            help="Seed of the random data")
+    run_parser.add_argument('-w', '--workers', type=int, default=4,
+                            help="Workers (and splits) of the parallel \
+                                  methods")
+    run_parser.add_argument('-W', '--width', type=int, default=2058,
+                            help="Width in pixels of the image")
+    run_parser.add_argument('-H', '--height', type=int, default=1746,
+                            help="Height in pixels of the image")
+    run_parser.add_argument('-r', '--repeat', type=int, default=3,
+                            help="Runs of every stage (the best counts)")
+    run_parser.add_argument('-m', '--methods', nargs='+', default=METHODS,
+                            choices=METHODS, help="Methods to measure")
+    run_parser.add_argument('-o', '--output',
+                            help="JSON file of results (by default, the \
+                                  standard output)")
+
+    compare_parser = subparsers.add_parser(
+        'compare', help="Compare two results and fail if slower")
+    compare_parser.add_argument('old', help="JSON file of the reference")
+    compare_parser.add_argument('new', help="JSON file to check")
+    compare_parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                                help="Allowed relative slowdown (0.1 is 10%%)")
+    compare_parser.add_argument('-d', '--min-delta', type=float,
+                                default=0.005,
+                                help="Allowed absolute slowdown in seconds")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        exit(1 if compare(old, new, args.tolerance, args.min_delta) else 0)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
@@ -39,5 +39,22 @@
     :license: BSD 2-Clause "Simplified" License
 """
 
+from geoipmap.geoanim import GeoAnimation
+from geoipmap.geoanim import read_events
+from geoipmap.geobatch import GeoBatch
+from geoipmap.geobatch import read_groups
+from geoipmap.geobulk import GeoBulk
+from geoipmap.geocache import GeoCache
+from geoipmap.geodensity import GeoDensity
 from geoipmap.geoimage import GeoImage
+from geoipmap.geoindex import GeoIndex
+from geoipmap.geoindex import GeoIndex6
+from geoipmap.geoindex import compiled_file
 from geoipmap.geoipmap import GeoIpMap
+from geoipmap.geopatch import GeoPatch
+from geoipmap.georaster import GeoRaster
+from geoipmap.geoserver import GeoClient
+from geoipmap.geoserver import GeoServer
+from geoipmap.geostats import GeoStats
+from geoipmap.geostream import GeoStream
+from geoipmap.geotiles import GeoTiles
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Animated maps of timestamped IPs, one frame per interval of time"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import csv
+import datetime
+from geoipmap.geobatch import GeoBatch
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+# Formats of the animations written from the frames
+ANIMATION_FORMATS = ('gif', 'mp4')
+
+# Longest run of empty intervals kept as frames; longer ones are skipped
+MAX_GAP = 24
+
+
+def parse_time(text):
+    """Converts a timestamp into seconds since the epoch.
+
+    :param text: Seconds since the epoch, or date and time in ISO 8601
+                 (UTC unless it has a timezone)
+    :type text: str
+    :return: Seconds since the epoch, or `None` if it is not valid
+    :rtype: float
+    """
+    text = text.strip()
+    try:
+        seconds = float(text)
+    except ValueError:
+        pass
+    else:
+        return seconds if math.isfinite(seconds) else None
+    try:
+        moment = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def read_events(lines):
+    """Reads timestamped IPs from CSV lines with 'timestamp,ip'.
+
+    The rows with an invalid timestamp, such as a header, are skipped.
+
+    :param lines: Lines of CSV, or an open file
+    :type lines: iterable
+    :return: Pairs of seconds since the epoch and IP address
+    :rtype: list
+    """
+    events = []
+    for row in csv.reader(lines):
+        if len(row) >= 2:
+            moment = parse_time(row[0])
+            if moment is not None:
+                events.append((moment, row[1]))
+    return events
+
+
+def bucket_events(events, interval, max_gap=MAX_GAP):
+    """Groups timestamped IPs into consecutive intervals of time.
+
+    The intervals are aligned to multiples of `interval` since the
+    epoch (e.g., to the hours).  The empty intervals between two with
+    IPs are kept, so the time runs evenly through the frames, unless
+    there are more than `max_gap` in a row: such a gap (e.g., after a
+    wrong timestamp) is skipped altogether.
+
+    :param events: Pairs of seconds since the epoch and IP address
+    :type events: iterable
+    :param interval: Seconds per interval
+    :type interval: float
+    :param max_gap: Longest run of empty intervals kept
+    :type max_gap: int
+    :return: Start of every interval and its IPs, in order of time
+    :rtype: list
+    """
+    buckets = {}
+    for moment, ip in events:
+        buckets.setdefault(math.floor(moment / interval), []).append(ip)
+    result = []
+    previous = None
+    for bucket in sorted(buckets):
+        if previous is not None and bucket - previous - 1 <= max_gap:
+            result.extend((empty * interval, [])
+                          for empty in range(previous + 1, bucket))
+        result.append((bucket * interval, buckets[bucket]))
+        previous = bucket
+    return result
+
+
+class GeoAnimation(object):
+    """Renders the IPs of every interval of time as a frame.
+
+    The frames are rendered by a `GeoBatch`, so the map image is decoded
+    once and every frame only stamps the markers of its interval over a
+    copy of it, in parallel.  The frames are written as a sequence of
+    images, or joined into a GIF (with Pillow, which `matplotlib`
+    requires) or an MP4 video (with the `ffmpeg` program).
+    """
+    def __init__(self, geo, interval=3600, fps=4, radius=None,
+                 num_workers=4):
+        """Animation for an already loaded `GeoIpMap`:
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param interval: Seconds per frame
+        :type interval: float
+        :param fps: Frames per second of the animation
+        :type fps: float
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        :param num_workers: Number of processes rendering frames
+        :type num_workers: int
+        """
+        self._geo = geo
+        self._interval = interval
+        self._fps = fps
+        self._batch = GeoBatch(geo, radius, num_workers)
+
+    def __get_interval(self):
+        return self._interval
+
+    def __get_fps(self):
+        return self._fps
+
+    def render_frames(self, events, output_dir, fmt='png'):
+        """Renders a frame per interval of time into a directory.
+
+        The frames are named after their number, e.g., 'frame-00000.png',
+        so they sort in order of time.
+
+        :param events: Pairs of seconds since the epoch and IP address
+        :type events: iterable
+        :param output_dir: Directory of the frames
+        :type output_dir: str
+        :param fmt: Format (extension) of the frames
+        :type fmt: str
+        :return: Start of the interval of every frame, path of the frame
+                 and number of pixels drawn, in order of time
+        :rtype: list
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        buckets = bucket_events(events, self._interval)
+        results = self._batch.render_many(
+            (ips, os.path.join(output_dir,
+                               'frame-{:05d}.{}'.format(number, fmt)))
+            for number, (_, ips) in enumerate(buckets))
+        return [(start,) + result
+                for (start, _), result in zip(buckets, results)]
+
+    def render(self, events, output):
+        """Renders the animation of some timestamped IPs.
+
+        The kind of output is given by its extension: '.gif' or '.mp4'
+        for an animation, or else a directory of PNG frames.
+
+        :param events: Pairs of seconds since the epoch and IP address
+        :type events: iterable
+        :param output: Path of the animation or the directory of frames
+        :type output: str
+        :return: Start of the interval of every frame and number of
+                 pixels drawn, in order of time
+        :rtype: list
+        :raises RuntimeError: If `ffmpeg` is not found for an MP4 video
+        """
+        fmt = os.path.splitext(output)[1][1:].lower()
+        if fmt not in ANIMATION_FORMATS:
+            return [(start, count) for start, _, count
+                    in self.render_frames(events, output)]
+        if fmt == 'mp4' and shutil.which('ffmpeg') is None:
+            raise RuntimeError("Writing MP4 videos requires 'ffmpeg'")
+
+        with tempfile.TemporaryDirectory() as frames_dir:
+            frames = self.render_frames(events, frames_dir)
+            with self._geo.stats.stage('encode', len(frames)):
+                if fmt == 'gif':
+                    self.__write_gif([path for _, path, _ in frames],
+                                     output)
+                else:
+                    self.__write_mp4(frames_dir, output)
+        return [(start, count) for start, _, count in frames]
+
+    def __write_gif(self, frame_files, output_file):
+        """Joins some frames into an animated GIF.
+
+        The frames are read one at a time, as they are appended, so
+        only one file is open at once.
+        """
+        from PIL import Image
+
+        def read(path):
+            with Image.open(path) as image:
+                image.load()
+                return image
+
+        if not frame_files:
+            return
+        first = read(frame_files[0])
+        first.save(output_file, save_all=True,
+                   append_images=(read(path) for path in frame_files[1:]),
+                   loop=0, duration=int(round(1000 / self._fps)))
+
+    def __write_mp4(self, frames_dir, output_file):
+        """Joins the frames of a directory into an MP4 video."""
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error',
+             '-framerate', str(self._fps),
+             '-i', os.path.join(frames_dir, 'frame-%05d.png'),
+             # H.264 needs even dimensions
+             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+             '-pix_fmt', 'yuv420p', output_file], check=True)
+
+    # Properties
+    interval = property(__get_interval)
+    fps = property(__get_fps)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoAnimation({}s per frame, {} fps)".format(
+            self._interval, self._fps)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Rendering of many IP lists against the same database and map"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import csv
+from geoipmap.geopool import call_shared
+from geoipmap.geopool import can_fork
+from geoipmap.geopool import fork_pool
+from geoipmap.georaster import GeoRaster
+from geoipmap.ipparse import ip6_to_int
+from geoipmap.ipparse import ip_to_int
+from geoipmap.ipparse import split_ips
+import os
+
+
+def read_groups(groups_file):
+    """Reads a CSV file with 'group,ip' into a list of IPs per group.
+
+    The rows with an invalid IP address, such as a header, are skipped.
+
+    :param groups_file: Path of the CSV file
+    :type groups_file: str
+    :return: IPs of every group, in order of appearance of the groups
+    :rtype: dict
+    """
+    groups = {}
+    with open(groups_file, 'rt') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2:
+                ip = row[1].strip()
+                if ip_to_int(ip) is not None or ip6_to_int(ip) is not None:
+                    groups.setdefault(row[0], []).append(ip)
+    return groups
+
+
+class GeoBatch(object):
+    """Renders many maps, one per IP list, with the same `GeoIpMap`.
+
+    The database is loaded and the map image is decoded only once, and
+    every output is rendered over a copy of the decoded image.  The
+    outputs are rendered in parallel by a pool of forked processes,
+    which share the database and the decoded image with the parent.
+    """
+    def __init__(self, geo, radius=None, num_workers=4):
+        """Batch for an already loaded `GeoIpMap`:
+
+        When the `GeoIpMap` has a cache, the outputs are rendered one
+        after the other, as the cache cannot be shared by processes.
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        :param num_workers: Number of processes rendering outputs
+        :type num_workers: int
+        """
+        self._geo = geo
+        self._radius = radius
+        self._num_workers = num_workers
+        self._raster = GeoRaster(geo.img)
+
+    def __get_raster(self):
+        return self._raster
+
+    def render_one(self, ips, output_file):
+        """Renders the map of an IP list.
+
+        :param ips: Path of the IP list, or its lines
+        :type ips: str
+        :param output_file: Path of the output image
+        :type output_file: str
+        :return: Path of the output image and number of pixels drawn
+        :rtype: pair
+        """
+        if isinstance(ips, str):
+            with open(ips, 'rt') as f:
+                pixels = self._geo.to_pixels(*split_ips(f), parallel=False)
+        else:
+            pixels = self._geo.to_pixels(*split_ips(ips), parallel=False)
+        self._raster.save(self._raster.render(pixels, self._radius),
+                          output_file)
+        return (output_file, len(pixels))
+
+    def render_many(self, jobs):
+        """Renders the map of many IP lists.
+
+        :param jobs: Pairs of IP list (path or lines) and output image
+        :type jobs: iterable
+        :return: Path of every output image and number of pixels drawn,
+                 in the order of the jobs
+        :rtype: list
+        """
+        jobs = list(jobs)
+        with self._geo.stats.stage('batch', len(jobs)):
+            # Decoded before forking, so the workers share it
+            self._raster.base
+            if self._num_workers <= 1 or len(jobs) <= 1 or \
+               self._geo.cache is not None or \
+               not can_fork():
+                return [self.render_one(*job) for job in jobs]
+
+            with fork_pool(self, min(self._num_workers, len(jobs))) as pool:
+                return pool.map(call_shared, [('render_one', job)
+                                              for job in jobs], chunksize=1)
+
+    def render_files(self, ips_files, output_dir, fmt='png'):
+        """Renders the map of many IP list files into a directory.
+
+        Every output is named after its IP list, e.g., 'web.lst' is
+        rendered as 'web.png'.
+
+        :param ips_files: Paths of the IP lists
+        :type ips_files: iterable
+        :param output_dir: Directory of the output images
+        :type output_dir: str
+        :param fmt: Format (extension) of the output images
+        :type fmt: str
+        :return: Path of every output image and number of pixels drawn
+        :rtype: list
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        return self.render_many(
+            (ips_file, os.path.join(output_dir, '{}.{}'.format(
+                os.path.splitext(os.path.basename(ips_file))[0], fmt)))
+            for ips_file in ips_files)
+
+    def render_groups(self, groups, output_dir, fmt='png'):
+        """Renders the map of every group of IPs into a directory.
+
+        Every output is named after its group.
+
+        :param groups: IPs of every group (see `read_groups`)
+        :type groups: dict
+        :param output_dir: Directory of the output images
+        :type output_dir: str
+        :param fmt: Format (extension) of the output images
+        :type fmt: str
+        :return: Path of every output image and number of pixels drawn
+        :rtype: list
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        return self.render_many(
+            (ips, os.path.join(output_dir, '{}.{}'.format(
+                group.replace(os.sep, '_'), fmt)))
+            for group, ips in groups.items())
+
+    # Properties
+    raster = property(__get_raster)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoBatch({} workers)".format(self._num_workers)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Lookups of IP lists larger than the memory, in bounded chunks"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import csv
+from geoipmap.geodensity import GeoDensity
+from geoipmap.geoipmap import write_locations
+from geoipmap.georaster import GeoRaster
+from geoipmap.ipparse import IPV6_DTYPE
+from geoipmap.ipparse import int_to_ip
+from geoipmap.ipparse import ipv6_to_ips
+from geoipmap.ipparse import split_ips
+import itertools
+import numpy as np
+import os
+import tempfile
+
+
+# Estimated memory per line of the IP list: the line itself, the IP as
+# integer, and the arrays of its lookup and projection
+_BYTES_PER_LINE = 128
+
+# Dtypes of the IPs of every version in the spill files (big-endian, so
+# the first byte of a record is the first byte of the address)
+_SPILL_DTYPES = (np.dtype('>u4'), IPV6_DTYPE)
+
+
+class GeoBulk(object):
+    """Looks up an IP list of any size with a bounded memory.
+
+    The list is read in chunks, and every chunk is looked up and added
+    to the result before reading the next one, so the memory used
+    depends on the size of the chunks, not on the length of the list:
+
+      * `pixels`: The networks found are marked in an array of flags,
+        one byte per network of the database, so the duplicated IPs
+        take no memory at all.
+      * `density`: The IPs are counted in the grid of the image.
+      * `export`: The IPs are spilled to temporary files by their first
+        byte, and then every file is deduplicated, looked up and
+        written in turn (an external sort).  A file larger than the
+        limit is split again by the next byte.
+
+    The chunks are looked up in this process, whatever the method of
+    the `GeoIpMap`, as starting a pool per chunk costs more than it
+    saves.
+
+    The database must be loaded (i.e., not with method 'merge'), and it
+    should not be refreshed meanwhile.
+    """
+    def __init__(self, geo, memory_limit=256 << 20, tmp_dir=None):
+        """Out-of-core lookups with an already loaded `GeoIpMap`:
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param memory_limit: Approximate memory for the IPs in bytes
+        :type memory_limit: int
+        :param tmp_dir: Directory of the temporary files of `export`
+        :type tmp_dir: str
+        :raises ValueError: If the database is not loaded
+        """
+        if geo.geodb is None:
+            raise ValueError("The out-of-core mode needs the database "
+                             "loaded; it cannot be used with method 'merge'")
+        self._geo = geo
+        self._memory_limit = memory_limit
+        self._chunk_size = max(1024, memory_limit // _BYTES_PER_LINE)
+        self._tmp_dir = tmp_dir
+
+    def __get_chunk_size(self):
+        return self._chunk_size
+
+    def chunks(self, ips):
+        """Reads an IP list in chunks.
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :return: Generator of the IPv4 addresses as integers and the
+                 IPv6 addresses as pairs (`hi`, `lo`) of every chunk
+        :rtype: generator
+        """
+        if isinstance(ips, str):
+            with open(ips, 'rt') as f:
+                yield from self.chunks(f)
+            return
+
+        while True:
+            lines = list(itertools.islice(ips, self._chunk_size))
+            if not lines:
+                return
+            with self._geo.stats.stage('ips') as record:
+                chunk = split_ips(lines)
+                record['items'] = len(chunk[0]) + len(chunk[1])
+            del lines
+            yield chunk
+
+    def __located(self, positions, ipv6=False):
+        """Returns the coordinates of the networks at some positions.
+
+        :return: Latitudes and longitudes of the networks found
+        :rtype: pair
+        """
+        positions = positions[positions >= 0]
+        if not len(positions):
+            return (np.zeros(0, dtype=np.float32),) * 2
+        geodb = self._geo.geodb6 if ipv6 else self._geo.geodb
+        return (geodb.lats[positions], geodb.lons[positions])
+
+    def pixels(self, ips):
+        """Translates an IP list to pixels, like `GeoIpMap.ips_to_pixels`.
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :return: Pixel coordinates (`x`, `y`) of the networks found
+        :rtype: set
+        """
+        geodb, geodb6 = self._geo.geodb, self._geo.geodb6
+        seen = np.zeros(len(geodb), dtype=bool)
+        seen6 = np.zeros(len(geodb6) if geodb6 is not None else 0,
+                         dtype=bool)
+        for chunk, chunk6 in self.chunks(ips):
+            positions, positions6 = self._geo.find(chunk, chunk6,
+                                                   parallel=False)
+            seen[positions[positions >= 0]] = True
+            seen6[positions6[positions6 >= 0]] = True
+
+        lats, lons = self.__located(np.flatnonzero(seen))
+        if len(seen6):
+            lats6, lons6 = self.__located(np.flatnonzero(seen6), True)
+            lats = np.concatenate([lats, lats6])
+            lons = np.concatenate([lons, lons6])
+        with self._geo.stats.stage('projection', len(lats)):
+            return set(self._geo.geo_to_pixels(lats, lons))
+
+    def density(self, ips, cell_size=1):
+        """Counts how many IPs fall in every cell of the image, like
+        `GeoIpMap.density`.
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :param cell_size: Side of the cells in pixels
+        :type cell_size: int
+        :return: Grid of counts
+        :rtype: GeoDensity
+        """
+        density = GeoDensity(self._geo.img, cell_size)
+        for chunk, chunk6 in self.chunks(ips):
+            positions, positions6 = self._geo.find(chunk, chunk6,
+                                                   parallel=False)
+            for ipv6, found in ((False, positions), (True, positions6)):
+                lats, lons = self.__located(found, ipv6)
+                with self._geo.stats.stage('projection', len(lats)):
+                    density.add(*self._geo.img.geo_to_pixels(lats, lons))
+        return density
+
+    def export(self, ips, output):
+        """Writes the location of every different IP found as CSV, like
+        `GeoIpMap.export`, in order of the IPs (first the IPv4 ones).
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :param output: Path of the CSV file, or an open file
+        :type output: str
+        """
+        if not hasattr(output, 'write'):
+            with open(output, 'wt', newline='') as f:
+                return self.export(ips, f)
+
+        with tempfile.TemporaryDirectory(dir=self._tmp_dir) as tmp_dir:
+            with self._geo.stats.stage('spill') as record:
+                record['items'] = 0
+                for chunk in self.chunks(ips):
+                    for ipv6, values in enumerate(chunk):
+                        self.__spill(values, os.path.join(
+                            tmp_dir, 'ipv6' if ipv6 else 'ipv4'), 0)
+                        record['items'] += len(values)
+
+            writer = csv.writer(output)
+            writer.writerow(['ip', 'lat', 'lon', 'x', 'y'])
+            for ipv6 in (False, True):
+                prefix = os.path.join(tmp_dir, 'ipv6' if ipv6 else 'ipv4')
+                for byte in range(256):
+                    self.__drain(writer, '{}-{:02x}'.format(prefix, byte),
+                                 ipv6, 1)
+
+    def render(self, ips, output_file, radius=None):
+        """Writes the image with the pixels of an IP list, like
+        `GeoIpMap.render`.
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :param output_file: Path of the output image
+        :type output_file: str
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        """
+        pixels = self.pixels(ips)
+        with self._geo.stats.stage('render', len(pixels)):
+            raster = GeoRaster(self._geo.img)
+            raster.save(raster.render(pixels, radius), output_file)
+
+    def render_density(self, ips, output_file, cell_size=4, cmap='hot'):
+        """Writes the image with the density of an IP list, like
+        `GeoIpMap.render_density`.
+
+        :param ips: Path of the IP list, or an open file
+        :type ips: str
+        :param output_file: Path of the output image
+        :type output_file: str
+        :param cell_size: Side of the cells in pixels
+        :type cell_size: int
+        :param cmap: Name of the matplotlib colormap
+        :type cmap: str
+        """
+        density = self.density(ips, cell_size)
+        with self._geo.stats.stage('render', density.total):
+            raster = GeoRaster(self._geo.img)
+            raster.save(raster.render_density(density, cmap), output_file)
+
+    def __spill(self, values, prefix, depth):
+        """Appends IPs to the spill files of their byte at `depth`.
+
+        :param values: IP addresses (see `_SPILL_DTYPES`)
+        :type values: numpy.ndarray
+        :param prefix: Path prefix of the spill files
+        :type prefix: str
+        :param depth: Position of the byte of the addresses
+        :type depth: int
+        """
+        if not len(values):
+            return
+        values = values.astype(_SPILL_DTYPES[values.dtype.itemsize == 16])
+        keys = values.view(np.uint8).reshape(len(values), -1)[:, depth]
+        order = np.argsort(keys, kind='stable')
+        values, keys = values[order], keys[order]
+        bounds = np.searchsorted(keys, np.arange(257))
+        for byte in np.flatnonzero(np.diff(bounds)).tolist():
+            with open('{}-{:02x}'.format(prefix, byte), 'ab') as f:
+                values[bounds[byte]:bounds[byte + 1]].tofile(f)
+
+    def __drain(self, writer, path, ipv6, depth):
+        """Writes the locations of the different IPs of a spill file,
+        and removes it.
+
+        A file larger than the memory limit is split again by the byte
+        at `depth` of its addresses, and those files are drained in
+        turn.
+        """
+        if not os.path.exists(path):
+            return
+        dtype = _SPILL_DTYPES[ipv6]
+        size = os.path.getsize(path) // dtype.itemsize
+        if size > self._chunk_size and depth < dtype.itemsize:
+            with open(path, 'rb') as f:
+                while True:
+                    values = np.fromfile(f, dtype=dtype,
+                                         count=self._chunk_size)
+                    if not len(values):
+                        break
+                    self.__spill(values, path, depth)
+            os.remove(path)
+            for byte in range(256):
+                self.__drain(writer, '{}-{:02x}'.format(path, byte),
+                             ipv6, depth + 1)
+            return
+
+        values = np.unique(np.fromfile(path, dtype=dtype))
+        os.remove(path)
+        if ipv6:
+            positions = self._geo.find([], values, parallel=False)[1]
+        else:
+            values = values.astype(np.uint32)
+            positions = self._geo.find(values, parallel=False)[0]
+        found = positions >= 0
+        values, positions = values[found], positions[found]
+        lats, lons = self.__located(positions, ipv6)
+        with self._geo.stats.stage('projection', len(lats)):
+            xs, ys = self._geo.img.geo_to_pixels(lats, lons)
+        if ipv6:
+            ips = ipv6_to_ips(values)
+        else:
+            ips = map(int_to_ip, values.tolist())
+        write_locations(writer, ips, lats, lons, xs, ys)
+
+    # Properties
+    chunk_size = property(__get_chunk_size)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoBulk({} IPs per chunk)".format(self._chunk_size)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Persistent cache of the locations of IPs between runs"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import numpy as np
+import os
+import sqlite3
+
+
+# Maximum number of parameters in a query for old versions of SQLite
+_BATCH = 500
+
+
+class GeoCache(object):
+    """Cache of the locations of IPs, kept in a SQLite file.
+
+    Every entry maps an IP (or the block of IPs sharing a prefix) to
+    the position of its network in the database and its coordinates.
+    The IPs not found in the database are cached as well, with position
+    -1, so they are not looked up again.
+
+    The size of the cache is bounded: when it is exceeded, the least
+    recently used entries are evicted.  The cache is emptied whenever
+    the size or the modification time of the database change.
+    """
+    def __init__(self, cache_file, geodb_file, max_size=1000000, prefix=32):
+        """Opens (or creates) the cache for a database:
+
+        When `prefix` is less than 32, all the IPs of the same block
+        share the location of the first IP of the block looked up,
+        which is an approximation for networks smaller than the block.
+
+        :param cache_file: Path of the cache
+        :type cache_file: str
+        :param geodb_file: Database whose locations are cached
+        :type geodb_file: str
+        :param max_size: Maximum number of entries
+        :type max_size: int
+        :param prefix: Length of the prefix of the IPs used as key
+        :type prefix: int
+        """
+        self._max_size = max_size
+        self._shift = 32 - prefix
+        self._hits = 0
+        self._misses = 0
+        # Used from other threads too (e.g., when the database is
+        # refreshed by a server), always behind the lock of `GeoIpMap`
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS locations (
+                ip INTEGER PRIMARY KEY, network INTEGER,
+                lat REAL, lon REAL, used INTEGER);
+            CREATE INDEX IF NOT EXISTS locations_used
+                ON locations (used);
+        """)
+
+        stat = os.stat(geodb_file)
+        signature = '{}:{}:{}'.format(stat.st_size, stat.st_mtime_ns, prefix)
+        if self.__get_meta('signature') != signature:
+            with self._db:
+                self._db.execute("DELETE FROM locations")
+                self.__set_meta('signature', signature)
+                self.__set_meta('clock', '0')
+
+    def __get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?",
+                               (key,)).fetchone()
+        return row[0] if row else None
+
+    def __set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         (key, value))
+
+    def __get_hits(self):
+        return self._hits
+
+    def __get_misses(self):
+        return self._misses
+
+    def __tick(self):
+        """Advances the clock used to know the least recently used."""
+        clock = int(self.__get_meta('clock') or 0) + 1
+        self.__set_meta('clock', str(clock))
+        return clock
+
+    def get_many(self, ips):
+        """Finds the cached locations of many IPs.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :return: Mask of the IPs found in the cache, and the positions
+                 of their networks (-1 if none) and their coordinates
+        :rtype: tuple
+        """
+        keys = np.asarray(ips, dtype=np.int64) >> self._shift
+        found = {}
+        with self._db:
+            clock = self.__tick()
+            unique = np.unique(keys).tolist()
+            for i in range(0, len(unique), _BATCH):
+                batch = unique[i:i + _BATCH]
+                marks = ','.join('?' * len(batch))
+                found.update((row[0], row[1:]) for row in self._db.execute(
+                    "SELECT ip, network, lat, lon FROM locations "
+                    "WHERE ip IN ({})".format(marks), batch))
+                self._db.execute("UPDATE locations SET used = ? "
+                                 "WHERE ip IN ({})".format(marks),
+                                 [clock] + batch)
+
+        hits = np.array([key in found for key in keys.tolist()], dtype=bool)
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        lats = np.full(len(keys), np.nan)
+        lons = np.full(len(keys), np.nan)
+        for i in np.flatnonzero(hits).tolist():
+            network, lat, lon = found[int(keys[i])]
+            positions[i] = network
+            lats[i] = np.nan if lat is None else lat
+            lons[i] = np.nan if lon is None else lon
+        self._hits += int(hits.sum())
+        self._misses += len(keys) - int(hits.sum())
+        return (hits, positions, lats, lons)
+
+    def put_many(self, ips, positions, lats, lons):
+        """Caches the locations of many IPs.
+
+        The least recently used entries are evicted if the cache gets
+        bigger than its maximum size.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :param positions: Positions of their networks (-1 if none)
+        :type positions: sequence
+        :param lats: Latitudes in degrees (NaN if none)
+        :type lats: sequence
+        :param lons: Longitudes in degrees (NaN if none)
+        :type lons: sequence
+        """
+        keys = (np.asarray(ips, dtype=np.int64) >> self._shift).tolist()
+        with self._db:
+            clock = int(self.__get_meta('clock') or 0)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?)",
+                ((key, network,
+                  None if network < 0 else lat, None if network < 0 else lon,
+                  clock)
+                 for key, network, lat, lon in zip(
+                     keys, np.asarray(positions).tolist(),
+                     np.asarray(lats).tolist(), np.asarray(lons).tolist())))
+            excess = len(self) - self._max_size
+            if excess > 0:
+                self._db.execute("DELETE FROM locations WHERE ip IN ("
+                                 "SELECT ip FROM locations "
+                                 "ORDER BY used LIMIT ?)", (excess,))
+
+    def clear(self):
+        """Empties the cache, e.g., when the database is refreshed.
+
+        The cache is also marked as stale, so it is emptied again when
+        it is opened for the database file (whose locations may differ
+        from the ones cached from now on).
+        """
+        with self._db:
+            self._db.execute("DELETE FROM locations")
+            self.__set_meta('signature', '')
+
+    def close(self):
+        """Closes the file of the cache."""
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+
+    # Properties
+    hits = property(__get_hits)
+    misses = property(__get_misses)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoCache({} hits, {} misses)".format(self._hits, self._misses)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Aggregation of points into a grid of counts over the map image"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import numpy as np
+
+
+class GeoDensity(object):
+    """Grid counting how many points fall in every cell of an image.
+
+    The image is divided in square cells of `cell_size` pixels, and the
+    points are added in batches, so the memory used is the one of the
+    grid, no matter how many points are added.
+    """
+    def __init__(self, img, cell_size=1):
+        """Empty grid for a geo image:
+
+        :param img: Image object with information to plot
+        :type img: GeoImage
+        :param cell_size: Side of the cells in pixels
+        :type cell_size: int
+        """
+        self._img = img
+        self._cell_size = max(1, int(cell_size))
+        rows = -(-int(img.height) // self._cell_size)
+        cols = -(-int(img.width) // self._cell_size)
+        self._grid = np.zeros((rows, cols), dtype=np.int64)
+
+    def __get_cell_size(self):
+        return self._cell_size
+
+    def __get_grid(self):
+        return self._grid
+
+    def __get_total(self):
+        return int(self._grid.sum())
+
+    def add(self, xs, ys, weights=None):
+        """Counts a batch of points.
+
+        The points out of the image are ignored.
+
+        :param xs: Horizontal pixel coordinates of the points
+        :type xs: sequence
+        :param ys: Vertical pixel coordinates of the points
+        :type ys: sequence
+        :param weights: How many times every point is counted
+        :type weights: sequence
+        """
+        rows, cols = self._grid.shape
+        col = np.floor(np.asarray(xs, dtype=np.float64) / self._cell_size)
+        row = np.floor(np.asarray(ys, dtype=np.float64) / self._cell_size)
+        inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+        cells = (row[inside].astype(np.intp) * cols +
+                 col[inside].astype(np.intp))
+        if weights is not None:
+            weights = np.asarray(weights)[inside]
+        counts = np.bincount(cells, weights=weights, minlength=rows * cols)
+        self._grid += counts.astype(np.int64).reshape(rows, cols)
+
+    def cells(self):
+        """Returns the cells with some point and their counts.
+
+        :return: Pixel coordinates (`x`, `y`) of the center of every
+                 non-empty cell, and its count
+        :rtype: list
+        """
+        rows, cols = np.nonzero(self._grid)
+        half = self._cell_size / 2
+        return list(zip(zip((cols * self._cell_size + half).tolist(),
+                            (rows * self._cell_size + half).tolist()),
+                        self._grid[rows, cols].tolist()))
+
+    # Properties
+    cell_size = property(__get_cell_size)
+    grid = property(__get_grid)
+    total = property(__get_total)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoDensity({}x{} cells, {} points)".format(
+            self._grid.shape[1], self._grid.shape[0], self.total)
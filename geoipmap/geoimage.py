@@ -28,7 +28,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-"""Just a image class, more like a container for image information"""
+"""Just a image class, more like a container for image information and
+its Mercator projection"""
 
 __author__ = "J. A. Corbal"
 __copyright__ = "Copyright (C) 2019, J. A. Corbal"
@@ -39,8 +40,18 @@ __email__ = "jacorbal@gmail.com"
 __status__ = "Development"
 
 
+import math
+import numpy as np
+
+
 class GeoImage(object):
-    """Image class (more like a struct)."""
+    """Image class (more like a struct).
+
+    Besides the information of the image, it projects geographical
+    coordinates into pixels of the image.  The constants of the
+    projection only depend on the image, so they are computed once and
+    kept until any of its properties change.
+    """
     def __init__(self, filepath, width, height,
                  w_deg=-180, e_deg=180, s_deg=-89.9):
         """Geo image data:
@@ -58,6 +69,7 @@ class GeoImage(object):
         :param s_deg: Most fore south position in degrees
         :type s_deg: float
         """
+        self._projection = None
         self.__set_filepath(filepath)
         self.__set_width(width)
         self.__set_height(height)
@@ -90,19 +102,75 @@ class GeoImage(object):
     def __set_width(self, width):
         if (width > 0):
             self._width = width
+            self._projection = None
 
     def __set_height(self, height):
         if (height > 0):
             self._height = height
+            self._projection = None
 
     def __set_w_deg(self, w_deg):
         self._w_deg = w_deg
+        self._projection = None
 
     def __set_e_deg(self, e_deg):
         self._e_deg = e_deg
+        self._projection = None
 
     def __set_s_deg(self, s_deg):
         self._s_deg = s_deg
+        self._projection = None
+
+    def __get_projection(self):
+        """Returns the constants of the projection for this image.
+
+        :return: Pixels per degree of longitude, half the width of the
+                 whole map in pixels, and vertical offset of the most
+                 fore south position
+        :rtype: tuple
+        """
+        if self._projection is None:
+            lat_south_rad = math.radians(self._s_deg)
+            scale_x = self._width / (self._e_deg - self._w_deg)
+            half_width = scale_x * 360 / (2 * math.pi) / 2
+            offset_y = half_width * math.log((1 + math.sin(lat_south_rad)) /
+                                             (1 - math.sin(lat_south_rad)))
+            self._projection = (scale_x, half_width, offset_y)
+        return self._projection
+
+    def geo_to_pixel(self, lat, lon):
+        """Converts longitude and latitude to Mercator proj. coords.
+
+        :param lat: Latitude in degrees
+        :type lat: float
+        :param lon: Longitude in degrees
+        :type lon: float
+        :return: Pixel coordinates (`x`, `y`)
+        :rtype: pair
+        """
+        scale_x, half_width, offset_y = self.__get_projection()
+        sin_lat = math.sin(math.radians(lat))
+        x = (lon - self._w_deg) * scale_x
+        y = self._height - \
+            (half_width * math.log((1 + sin_lat) / (1 - sin_lat)) - offset_y)
+        return (x, y)
+
+    def geo_to_pixels(self, lats, lons):
+        """Converts arrays of latitudes and longitudes at once.
+
+        :param lats: Latitudes in degrees
+        :type lats: sequence
+        :param lons: Longitudes in degrees
+        :type lons: sequence
+        :return: Arrays of pixel coordinates (`xs`, `ys`)
+        :rtype: pair
+        """
+        scale_x, half_width, offset_y = self.__get_projection()
+        sin_lats = np.sin(np.radians(np.asarray(lats, dtype=np.float64)))
+        xs = (np.asarray(lons, dtype=np.float64) - self._w_deg) * scale_x
+        ys = self._height - \
+            (half_width * np.log((1 + sin_lats) / (1 - sin_lats)) - offset_y)
+        return (xs, ys)
 
     # Properties
     filepath = property(__get_filepath, __set_filepath)
@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Sorted interval index of networks for fast IP lookups"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+from array import array
+import contextlib
+import csv
+from geoipmap.ipparse import IPV6_DTYPE
+from geoipmap.ipparse import cidr6_to_range
+from geoipmap.ipparse import cidr_to_range
+from geoipmap.ipparse import ints_to_ipv6
+import gzip
+import io
+import mmap
+import numpy as np
+import operator
+import os
+import struct
+import zipfile
+
+
+# Compiled format: header (magic, version, number of networks) followed
+# by the columns, in little-endian order, one after the other
+COMPILED_MAGIC = b'GEOIPMAP'
+COMPILED_MAGIC6 = b'GEOIPMP6'
+COMPILED_VERSION = 1
+COMPILED_EXT = '.idx'
+_HEADER = struct.Struct('<8sII')
+_DTYPES = (np.dtype('<u4'), np.dtype('<u4'),
+           np.dtype('<f4'), np.dtype('<f4'))
+_DTYPES6 = (IPV6_DTYPE, IPV6_DTYPE, np.dtype('<f4'), np.dtype('<f4'))
+
+# Minimum number of networks of an index to search the IPs in order
+_SORTED_LOOKUP = 1 << 19
+
+# Names of the columns in the header of a CSV database, and suffixes of
+# the CSV files of the networks in the GeoLite2 archives
+_COLUMNS = (('network',), ('latitude', 'lat'), ('longitude', 'lon'))
+_MEMBERS = ('Blocks-IPv4.csv', 'Blocks-IPv6.csv')
+
+
+def compiled_file(geodb_file, ipv6=False):
+    """Returns the path of the compiled version of a CSV database.
+
+    As a GeoLite2 archive has both the IPv4 and the IPv6 networks, the
+    compiled versions of an archive are named after the version.
+
+    :param geodb_file: Netmask, latitude and longitude CSV database
+    :type geodb_file: str
+    :param ipv6: When true, the networks are IPv6
+    :type ipv6: bool
+    :return: Path of the compiled database (it may not exist)
+    :rtype: str
+    """
+    base, ext = os.path.splitext(geodb_file)
+    if ext == '.gz':
+        base = os.path.splitext(base)[0]
+    elif ext == '.zip':
+        base += '-ipv6' if ipv6 else '-ipv4'
+    return base + COMPILED_EXT
+
+
+@contextlib.contextmanager
+def open_csv(geodb_file, ipv6=False):
+    """Opens a CSV database as text, even if it is compressed.
+
+    A '.gz' file is decompressed while reading.  From a '.zip' archive,
+    such as 'GeoLite2-City-CSV.zip', the networks of the IP version are
+    read (e.g., 'GeoLite2-City-Blocks-IPv4.csv'), or the only CSV file
+    of the archive, if there is just one.
+
+    :param geodb_file: CSV database, compressed or not
+    :type geodb_file: str
+    :param ipv6: When true, read the IPv6 networks of an archive
+    :type ipv6: bool
+    :return: Context manager of the open file
+    :rtype: file
+    :raises ValueError: If the archive has no CSV file of networks
+    """
+    if geodb_file.endswith('.gz'):
+        with gzip.open(geodb_file, 'rt', newline='') as f:
+            yield f
+    elif zipfile.is_zipfile(geodb_file):
+        with zipfile.ZipFile(geodb_file) as archive:
+            names = [name for name in archive.namelist()
+                     if name.endswith(_MEMBERS[ipv6])]
+            if not names:
+                names = [name for name in archive.namelist()
+                         if name.endswith('.csv')]
+                if len(names) != 1:
+                    raise ValueError("No '{}' file in '{}'"
+                                     .format(_MEMBERS[ipv6], geodb_file))
+            with archive.open(names[0]) as member:
+                yield io.TextIOWrapper(member, newline='')
+    else:
+        with open(geodb_file, 'rt', newline='') as f:
+            yield f
+
+
+def read_csv(geodb_file, ipv6=False):
+    """Reads a CSV database row by row.
+
+    The columns of the network, latitude and longitude are chosen by
+    the names in the header, so the CSV files of the GeoLite2 databases
+    can be read as they are; with no header, they are the first three
+    columns.  The comments, the blank lines and the networks with no
+    coordinates are skipped.  The file may be compressed (see
+    `open_csv`).
+
+    :param geodb_file: Netmask, latitude and longitude CSV database
+    :type geodb_file: str
+    :param ipv6: When true, the networks are IPv6
+    :type ipv6: bool
+    :return: Generator of (`start`, `end`, `lat`, `lon`) for every
+             network, in the order of the file
+    :rtype: generator
+    :raises ValueError: If the header lacks any of the columns
+    """
+    to_range = cidr6_to_range if ipv6 else cidr_to_range
+    with open_csv(geodb_file, ipv6) as f:
+        select = None
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            if select is None:
+                select = _select_columns(row, geodb_file)
+                if select is not None:
+                    continue
+                select = operator.itemgetter(0, 1, 2)
+            nw, lat, lon = select(row)
+            if not lat or not lon:
+                continue
+            start, end = to_range(nw)
+            yield (start, end, float(lat), float(lon))
+
+
+def _select_columns(header, geodb_file):
+    """Returns the getter of the network, latitude and longitude of the
+    rows of a CSV database, or `None` if the row is not a header."""
+    names = [name.strip().lower() for name in header]
+    if 'network' not in names:
+        return None
+    columns = []
+    for aliases in _COLUMNS:
+        found = [names.index(alias) for alias in aliases if alias in names]
+        if not found:
+            raise ValueError("No column '{}' in '{}'"
+                             .format(aliases[0], geodb_file))
+        columns.append(found[0])
+    return operator.itemgetter(*columns)
+
+
+def read_geodb(geodb_file):
+    """Reads a database, either CSV or compiled, row by row.
+
+    :param geodb_file: CSV database or the compiled version of it
+    :type geodb_file: str
+    :return: Generator of (`start`, `end`, `lat`, `lon`) for every
+             network
+    :rtype: generator
+    """
+    if GeoIndex.is_compiled(geodb_file):
+        return iter(GeoIndex.load(geodb_file))
+    return read_csv(geodb_file)
+
+
+class GeoIndex(object):
+    """Index of networks sorted by their first address.
+
+    Every network in CIDR notation is converted once into its integer
+    bounds [`start`, `end`], so finding the network an IP address
+    belongs to is a binary search over the starts of the networks
+    instead of a test against every row of the database.
+
+    The index is stored as four parallel typed arrays (columns): the
+    starts and ends of the networks as `uint32`, and their latitudes
+    and longitudes as `float32`, i.e., 16 bytes per network.
+
+    ..note:: Networks are expected not to overlap, as it happens in the
+             GeoLite2 databases.
+    """
+    _magic = COMPILED_MAGIC
+    _dtypes = _DTYPES
+
+    def __init__(self, starts=(), ends=(), lats=(), lons=()):
+        """Builds the index from the columns of the networks.
+
+        The columns do not need to be sorted.
+
+        :param starts: First address of every network as integer
+        :type starts: sequence
+        :param ends: Last address of every network as integer
+        :type ends: sequence
+        :param lats: Latitude of every network in degrees
+        :type lats: sequence
+        :param lons: Longitude of every network in degrees
+        :type lons: sequence
+        """
+        self._path = None
+        self._starts = np.asarray(starts, dtype=np.uint32)
+        self._ends = np.asarray(ends, dtype=np.uint32)
+        self._lats = np.asarray(lats, dtype=np.float32)
+        self._lons = np.asarray(lons, dtype=np.float32)
+        if np.any(self._starts[1:] < self._starts[:-1]):
+            order = np.argsort(self._starts, kind='stable')
+            self._starts = self._starts[order]
+            self._ends = self._ends[order]
+            self._lats = self._lats[order]
+            self._lons = self._lons[order]
+
+    @classmethod
+    def from_csv(cls, geodb_file):
+        """Builds the index from a CSV file with 'network,lat,lon'.
+
+        The columns are filled while reading, so no intermediate Python
+        object is kept per row.
+
+        :param geodb_file: Netmask, latitude and longitude CSV database
+        :type geodb_file: str
+        :return: The index of the database
+        :rtype: GeoIndex
+        :see: read_csv
+        """
+        starts, ends = array('I'), array('I')
+        lats, lons = array('f'), array('f')
+        for start, end, lat, lon in read_csv(geodb_file):
+            starts.append(start)
+            ends.append(end)
+            lats.append(lat)
+            lons.append(lon)
+        return cls(starts, ends, lats, lons)
+
+    @classmethod
+    def load(cls, geodb_file):
+        """Opens a compiled database (see `save`).
+
+        The file is mapped in memory and the columns point directly to
+        the mapped pages, so there is no parsing nor copying, and all
+        the processes opening the same file share its pages.
+
+        :param geodb_file: Compiled database
+        :type geodb_file: str
+        :return: The index of the database
+        :rtype: GeoIndex
+        :raises ValueError: If the file is not a valid compiled database
+        """
+        with open(geodb_file, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < _HEADER.size:
+            raise ValueError("'{}' is not a compiled geodb"
+                             .format(geodb_file))
+        magic, version, count = _HEADER.unpack_from(buf)
+        if magic != cls._magic:
+            raise ValueError("'{}' is not a compiled geodb"
+                             .format(geodb_file))
+        if version != COMPILED_VERSION:
+            raise ValueError("'{}' has an unsupported version ({})"
+                             .format(geodb_file, version))
+        if len(buf) < _HEADER.size + count * cls.row_size():
+            raise ValueError("'{}' is truncated".format(geodb_file))
+
+        index = cls.from_buffer(buf, count, _HEADER.size)
+        index._path = geodb_file
+        return index
+
+    @classmethod
+    def open(cls, geodb_file):
+        """Opens a database, either CSV or compiled.
+
+        :param geodb_file: CSV database or the compiled version of it
+        :type geodb_file: str
+        :return: The index of the database
+        :rtype: GeoIndex
+        :see: from_csv, load
+        """
+        if cls.is_compiled(geodb_file):
+            return cls.load(geodb_file)
+        return cls.from_csv(geodb_file)
+
+    @classmethod
+    def from_buffer(cls, buf, count, offset=0):
+        """Builds the index over the columns written in a buffer (see
+        `write`), with no copy.
+
+        :param buf: Buffer with the columns, one after the other
+        :type buf: buffer
+        :param count: Number of networks
+        :type count: int
+        :param offset: Position of the first column in the buffer
+        :type offset: int
+        :return: The index of the buffer
+        :rtype: GeoIndex
+        """
+        columns = []
+        for dtype in cls._dtypes:
+            columns.append(np.frombuffer(buf, dtype=dtype, count=count,
+                                         offset=offset))
+            offset += count * dtype.itemsize
+
+        index = cls.__new__(cls)
+        index._path = None
+        index._starts, index._ends, index._lats, index._lons = columns
+        return index
+
+    @classmethod
+    def row_size(cls):
+        """Returns the size in bytes of a network in the columns.
+
+        :rtype: int
+        """
+        return sum(dtype.itemsize for dtype in cls._dtypes)
+
+    @classmethod
+    def is_compiled(cls, geodb_file):
+        """Checks if a file is a compiled database.
+
+        :param geodb_file: Path to the database
+        :type geodb_file: str
+        :rtype: bool
+        """
+        with open(geodb_file, 'rb') as f:
+            return f.read(len(cls._magic)) == cls._magic
+
+    def save(self, geodb_file):
+        """Writes the index as a compiled database.
+
+        The file is written aside and then renamed, so a process reading
+        the previous version is never exposed to a partial file.
+
+        :param geodb_file: Path of the compiled database
+        :type geodb_file: str
+        """
+        tmp_file = geodb_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_HEADER.pack(self._magic, COMPILED_VERSION, len(self)))
+            self.write(f)
+        os.replace(tmp_file, geodb_file)
+
+    def write(self, f):
+        """Writes the columns of the index, one after the other.
+
+        :param f: Binary file open for writing
+        :type f: file
+        """
+        for column, dtype in zip(self.columns(), self._dtypes):
+            f.write(column.astype(dtype, copy=False).tobytes())
+
+    def columns(self):
+        """Returns the columns of the index.
+
+        :return: Starts, ends, latitudes and longitudes of the networks
+        :rtype: tuple
+        """
+        return (self._starts, self._ends, self._lats, self._lons)
+
+    @staticmethod
+    def sortable(ips):
+        """Returns IP addresses in a form `numpy.searchsorted` compares
+        in the order of the addresses.
+
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return ips
+
+    def __get_starts(self):
+        return self._starts
+
+    def __get_ends(self):
+        return self._ends
+
+    def __get_lats(self):
+        return self._lats
+
+    def __get_lons(self):
+        return self._lons
+
+    def lookup(self, ip):
+        """Finds the position of the network containing an IP.
+
+        :param ip: IP address as an integer
+        :type ip: int
+        :return: Position of the network in the index, or -1 if none
+        :rtype: int
+        """
+        return int(self.lookup_many([ip])[0])
+
+    def lookup_many(self, ips):
+        """Finds the positions of the networks containing many IPs.
+
+        All the binary searches are performed in a single pass over the
+        array of IPs, in numpy, which releases the GIL meanwhile.  When
+        the index is much larger than the CPU caches, the IPs are
+        searched in order, so consecutive searches go through the same
+        pages of the index.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :return: Positions of the networks in the index (-1 if none)
+        :rtype: numpy.ndarray
+        """
+        ips = np.asarray(ips, dtype=np.uint32)
+        if not len(self._starts):
+            return np.full(ips.shape, -1, dtype=np.int64)
+        if len(self._starts) >= _SORTED_LOOKUP and len(ips) > 1:
+            order = np.argsort(ips)
+            pos = np.empty(len(ips), dtype=np.int64)
+            pos[order] = np.searchsorted(self._starts, ips[order],
+                                         side='right')
+            pos -= 1
+        else:
+            pos = np.searchsorted(self._starts, ips, side='right') - 1
+        found = (pos >= 0) & (ips <= self._ends[np.maximum(pos, 0)])
+        return np.where(found, pos, -1)
+
+    def _follows(self):
+        """Returns the mask of the networks (but the first one) starting
+        right after the end of the previous one."""
+        return (self._starts[1:].astype(np.int64) ==
+                self._ends[:-1].astype(np.int64) + 1)
+
+    def coalesce(self, img=None):
+        """Merges the adjacent networks with the same location.
+
+        Consecutive networks without a gap between them and with the
+        same coordinates (such as many neighbouring /23 networks of the
+        GeoLite2 databases) are merged into a single range, so the index
+        is smaller, and so is its compiled file.
+
+        When `img` is given, the adjacent networks projecting into the
+        same pixel of that image are merged as well, even if their
+        coordinates differ; every range keeps the coordinates of its
+        first network.  The index is then only valid for that image.
+
+        :param img: Image whose pixels are the unit of location, if any
+        :type img: GeoImage
+        :return: The coalesced index (the same one if nothing is merged)
+        :rtype: GeoIndex
+        """
+        if len(self) < 2:
+            return self
+        if img is None:
+            same = ((self._lats[1:] == self._lats[:-1]) &
+                    (self._lons[1:] == self._lons[:-1]))
+        else:
+            xs, ys = img.geo_to_pixels(self._lats, self._lons)
+            xs, ys = np.floor(xs), np.floor(ys)
+            same = (xs[1:] == xs[:-1]) & (ys[1:] == ys[:-1])
+        first = np.flatnonzero(np.concatenate(
+            [[True], ~(same & self._follows())]))
+        if len(first) == len(self):
+            return self
+        last = np.append(first[1:] - 1, len(self) - 1)
+        return type(self)(self._starts[first], self._ends[last],
+                          self._lats[first], self._lons[first])
+
+    def location(self, i):
+        """Returns the coordinates of the network at position `i`.
+
+        :param i: Position of the network in the index
+        :type i: int
+        :return: Coordinates (`lat`, `lon`) in degrees
+        :rtype: pair
+        """
+        return (float(self._lats[i]), float(self._lons[i]))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        """Yields (`start`, `end`, `lat`, `lon`) for every network."""
+        chunk = 65536
+        for i in range(0, len(self), chunk):
+            yield from zip(self._starts[i:i + chunk].tolist(),
+                           self._ends[i:i + chunk].tolist(),
+                           self._lats[i:i + chunk].tolist(),
+                           self._lons[i:i + chunk].tolist())
+
+    def __reduce__(self):
+        """Pickles a compiled index as its path, so it is mapped again
+        (sharing its pages) instead of copied."""
+        if self._path:
+            return (type(self).load, (self._path,))
+        return (type(self), self.columns())
+
+    # Properties
+    starts = property(__get_starts)
+    ends = property(__get_ends)
+    lats = property(__get_lats)
+    lons = property(__get_lons)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoIndex({} networks)".format(len(self))
+
+
+class GeoIndex6(GeoIndex):
+    """Index of IPv6 networks sorted by their first address.
+
+    It works as `GeoIndex`, but the starts and ends of the networks are
+    128-bit integers, kept as pairs (`hi`, `lo`) of `uint64` (see
+    `IPV6_DTYPE`), i.e., 40 bytes per network.  As the halves are
+    big-endian, the binary search compares the 16 bytes of every
+    address at once.
+    """
+    _magic = COMPILED_MAGIC6
+    _dtypes = _DTYPES6
+
+    def __init__(self, starts=(), ends=(), lats=(), lons=()):
+        """Builds the index from the columns of the networks.
+
+        The columns do not need to be sorted.
+
+        :param starts: First address of every network, as integers or
+                       as pairs (`hi`, `lo`)
+        :type starts: sequence
+        :param ends: Last address of every network, as integers or as
+                     pairs (`hi`, `lo`)
+        :type ends: sequence
+        :param lats: Latitude of every network in degrees
+        :type lats: sequence
+        :param lons: Longitude of every network in degrees
+        :type lons: sequence
+        """
+        self._path = None
+        self._starts = _as_ipv6(starts)
+        self._ends = _as_ipv6(ends)
+        self._lats = np.asarray(lats, dtype=np.float32)
+        self._lons = np.asarray(lons, dtype=np.float32)
+        hi, lo = self._starts['hi'], self._starts['lo']
+        if np.any((hi[1:] < hi[:-1]) |
+                  ((hi[1:] == hi[:-1]) & (lo[1:] < lo[:-1]))):
+            order = np.argsort(self._starts, kind='stable')
+            self._starts = self._starts[order]
+            self._ends = self._ends[order]
+            self._lats = self._lats[order]
+            self._lons = self._lons[order]
+
+    @classmethod
+    def from_csv(cls, geodb_file):
+        """Builds the index from a CSV file with 'network,lat,lon', such
+        as the one made from 'GeoLite2-City-Blocks-IPv6.csv'.
+
+        :param geodb_file: Netmask, latitude and longitude CSV database
+        :type geodb_file: str
+        :return: The index of the database
+        :rtype: GeoIndex6
+        :see: read_csv
+        """
+        starts, ends = bytearray(), bytearray()
+        lats, lons = array('f'), array('f')
+        for start, end, lat, lon in read_csv(geodb_file, ipv6=True):
+            starts += start.to_bytes(16, 'big')
+            ends += end.to_bytes(16, 'big')
+            lats.append(lat)
+            lons.append(lon)
+        return cls(np.frombuffer(bytes(starts), dtype=IPV6_DTYPE),
+                   np.frombuffer(bytes(ends), dtype=IPV6_DTYPE),
+                   lats, lons)
+
+    def lookup_many(self, ips):
+        """Finds the positions of the networks containing many IPs.
+
+        :param ips: IPv6 addresses as integers or as pairs (`hi`, `lo`)
+        :type ips: sequence
+        :return: Positions of the networks in the index (-1 if none)
+        :rtype: numpy.ndarray
+        """
+        ips = _as_ipv6(ips)
+        if not len(self._starts):
+            return np.full(ips.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.sortable(self._starts),
+                              self.sortable(ips), side='right') - 1
+        ends = self._ends[np.maximum(pos, 0)]
+        found = (pos >= 0) & ((ips['hi'] < ends['hi']) |
+                              ((ips['hi'] == ends['hi']) &
+                               (ips['lo'] <= ends['lo'])))
+        return np.where(found, pos, -1)
+
+    @staticmethod
+    def sortable(ips):
+        """Returns IP addresses as their 16 bytes, which compare in the
+        order of the addresses.
+
+        :param ips: IPv6 addresses as pairs (`hi`, `lo`)
+        :type ips: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return np.ascontiguousarray(ips).view('V16')
+
+    def _follows(self):
+        """Returns the mask of the networks (but the first one) starting
+        right after the end of the previous one."""
+        ends, starts = self._ends[:-1], self._starts[1:]
+        lo = ends['lo'] + np.uint64(1)
+        hi = np.where(lo == 0, ends['hi'] + np.uint64(1), ends['hi'])
+        return (starts['hi'] == hi) & (starts['lo'] == lo)
+
+    def __iter__(self):
+        """Yields (`start`, `end`, `lat`, `lon`) for every network, with
+        the addresses as integers."""
+        chunk = 65536
+        for i in range(0, len(self), chunk):
+            starts = self._starts[i:i + chunk].tobytes()
+            ends = self._ends[i:i + chunk].tobytes()
+            for j, lat, lon in zip(range(0, len(starts), 16),
+                                   self._lats[i:i + chunk].tolist(),
+                                   self._lons[i:i + chunk].tolist()):
+                yield (int.from_bytes(starts[j:j + 16], 'big'),
+                       int.from_bytes(ends[j:j + 16], 'big'), lat, lon)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoIndex6({} networks)".format(len(self))
+
+
+def _as_ipv6(values):
+    """Returns IPv6 addresses as a contiguous array of pairs (`hi`,
+    `lo`), converting them from integers if needed."""
+    if isinstance(values, np.ndarray) and values.dtype == IPV6_DTYPE:
+        return np.ascontiguousarray(values)
+    return ints_to_ipv6(values)
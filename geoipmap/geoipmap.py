@@ -37,7 +37,9 @@ Required:
   * List of IPs (one IP per line)
   * Geolocalization database in the format of a CSV with the following
     columns: 'network,latitude,longitude', where latitude and longitude
-    are floating point degrees.
+    are floating point degrees.  It is loaded once into a sorted index
+    of networks (see `GeoIndex`).  The database may also be compiled
+    beforehand into a binary file, which is mapped in memory.
   * Map image.  If the properties change, those changes must be
     addressed in this file.
 """
@@ -51,17 +53,53 @@ __email__ = "jacorbal@gmail.com"
 __status__ = "Development"
 
 
+import bisect
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import csv
-import math
-import matplotlib.patches
-import matplotlib.pyplot as plt
-import multiprocessing
-from netaddr import IPAddress
-from netaddr import IPNetwork
-from netaddr import valid_ipv4
+from geoipmap.geocache import GeoCache
+from geoipmap.geodensity import GeoDensity
+from geoipmap.geoindex import GeoIndex
+from geoipmap.geoindex import GeoIndex6
+from geoipmap.geoindex import read_geodb
+from geoipmap.geopatch import GeoPatch
+from geoipmap.geopool import call_shared
+from geoipmap.geopool import fork_pool
+from geoipmap.georaster import GeoRaster
+from geoipmap.georaster import default_radius
+from geoipmap.geostats import GeoStats
+from geoipmap.ipparse import int_to_ip
+from geoipmap.ipparse import ipv6_to_ips
+from geoipmap.ipparse import split_ips
+import numpy as np
+import os
 import threading
 
 
+def write_locations(writer, ips, lats, lons, xs, ys):
+    """Writes the location of some IPs as rows of CSV.
+
+    The columns are 'ip,lat,lon,x,y', with the coordinates rounded.
+
+    :param writer: CSV writer
+    :type writer: csv.writer
+    :param ips: IP addresses
+    :type ips: sequence
+    :param lats: Latitudes in degrees
+    :type lats: numpy.ndarray
+    :param lons: Longitudes in degrees
+    :type lons: numpy.ndarray
+    :param xs: Horizontal pixel coordinates
+    :type xs: numpy.ndarray
+    :param ys: Vertical pixel coordinates
+    :type ys: numpy.ndarray
+    """
+    for ip, lat, lon, x, y in zip(ips, lats.tolist(), lons.tolist(),
+                                  xs.tolist(), ys.tolist()):
+        writer.writerow([ip, '{:.4f}'.format(lat), '{:.4f}'.format(lon),
+                         '{:.3f}'.format(x), '{:.3f}'.format(y)])
+
+
 class GeoIpMap(object):
     """GeoIpMap class.  Get the data, calculate and plot.
 
@@ -69,7 +107,8 @@ class GeoIpMap(object):
 
       1. Get list of IPs and database of IPs and geocoordinates
       2. Convert IP addresses to pixels: `ips_to_pixels`
-      3. Plot the pixels in a image: `plot`
+      3. Plot the pixels in a image: `plot`, or write the image with
+         the pixels to a file: `render`
 
     In order to perform this actions, three files are needed:
 
@@ -77,7 +116,17 @@ class GeoIpMap(object):
       * `geodb_file`.  A CSV file with columns: 'netmask,lat,lon'
       * Image file.  Contained indirectly in the `img` object
 
-    ..note:: Right now, the files must be formatted with no comments.
+    Optionally, a fourth file holds the networks of the IPv6 addresses:
+
+      * `geodb6_file`.  A CSV file with columns: 'netmask,lat,lon',
+        with IPv6 networks
+
+    ..note:: The databases may have a header, comments and blank
+             lines, and their columns are selected by name, so the
+             GeoLite2 files (even in their '.zip' or a '.csv.gz') are
+             read as they are (see `read_csv`).  The lines of the IP
+             list which are not IP addresses are skipped, as well as
+             the IPv6 addresses when there is no `geodb6_file`.
 
     This class returns the `_pixels` set attribute when invoked for
     printing, containing the pairs (`x`, `y`) to be drawn in the map.
@@ -85,21 +134,24 @@ class GeoIpMap(object):
 
     def __init__(self, ips_file, geodb_file, img,
                  method='multiprocessing',  num_workers=4,
-                 num_splits=10, verbose=False):
+                 num_splits=10, verbose=False,
+                 cache_file=None, cache_size=1000000, stats=None,
+                 geodb6_file=None, cache_prefix=32):
         """Initializes the GeoIPMap object.
 
         If the method is 'threads', then the method for finding the IPs
         in the table with be done by the `threading` module (by the
-        applying `__ips_to_pixels_threading`); otherwise it will use the
-        `multiprocessing` module (using `__ips_to_pixels_multiprocessing`).
+        applying `__lookup_threading`); otherwise it will use the
+        `multiprocessing` module (using `__lookup_multiprocessing`).
         If `num_splits` is less or equal to one, none of those methods
         will be used, and the table search is done in the "classical
-        way" (with `__ips_to_pixels_raw`).
+        way" (with `__lookup_raw`).
 
         When using `method=threading`, the argument `num_splits`
-        indicate in how many chunks the list is divided in order to make
-        better comparisons.  This variable is nonfunctional when using
-        the multiprocessing method.
+        indicate in how many chunks the list of IPs is divided, which
+        are looked up by a pool of as many threads as cores (at most).
+        This variable is nonfunctional when using the multiprocessing
+        method.
 
         When using `method!=threading` (i.e., `method=multiprocessing`),
         the argument `num_workers` indicate how many workers are being
@@ -109,27 +161,66 @@ class GeoIpMap(object):
         When using `method=raw`, then no multiprocessing or threading is
         performed.
 
-        :param iplist_file: IP list file, one IP per line
+        When using `method=merge`, the database is not loaded at all,
+        but read row by row while looking up the IPs (see
+        `__lookup_merge`), so the memory used depends only on the
+        number of IPs.
+
+        When `cache_file` is set, the locations of the IPs are kept in
+        that file between runs, and only the IPs not found there are
+        looked up in the database (see `GeoCache`).  With a
+        `cache_prefix` shorter than 32 bits, the IPs of the same block
+        share an entry, taking the location of the first one looked up.
+
+        The IPv6 addresses of the list are looked up in their own index
+        (see `GeoIndex6`), loaded from `geodb6_file`, whatever the
+        method; they are not cached.
+
+        :param iplist_file: IP list file, one IP per line (or `None`,
+                            to only use `locate`)
         :type iplist_file: str
-        :param geodb_file: Netmask, latitude and longitude CSV database
+        :param geodb_file: Netmask, latitude and longitude CSV database,
+                           or the compiled version of it
         :type geodb_file: str
         :param img: Image object with information to plot
         :type img: GeoImage
-        :param num_splits: Splits of `geodb_file` for reading (threading)
+        :param num_splits: Splits of the IP list for reading (threading)
         :type num_splits: int
         :param num_workers: Number of workers when multiprocessing
         :type num_workers: int
         :param verbose: When true, print information on screen
         :type verbose: bool
+        :param cache_file: Path of the cache of locations, if any
+        :type cache_file: str
+        :param cache_size: Maximum number of IPs in the cache
+        :type cache_size: int
+        :param stats: Where to record the time, memory and items of
+                      every stage (see `GeoStats`)
+        :type stats: GeoStats
+        :param geodb6_file: Netmask, latitude and longitude CSV database
+                            of IPv6 networks, or the compiled version of
+                            it (if any)
+        :type geodb6_file: str
+        :param cache_prefix: Length of the prefix of the IPs used as key
+                             of the cache (e.g., 24 for blocks of 256)
+        :type cache_prefix: int
         """
         self._pixels = set()
+        self._counts = collections.Counter()
+        # Storage of the IPs added by `update`, with room to grow
+        self._ips_buffer = None
         self._img = img
         self._method = method
         self._verbose = verbose
+        self._stats = stats if stats is not None else GeoStats()
         self.__set_num_splits(num_splits)
         self.__set_num_workers(num_workers)
         self.__set_geodb(geodb_file)
+        self.__set_geodb6(geodb6_file)
         self.__set_ips(ips_file)
+        self._cache = GeoCache(cache_file, geodb_file, cache_size,
+                               cache_prefix) if cache_file else None
+        self._cache_lock = threading.Lock()
 
     def __get_num_splits(self):
         return self._num_splits
@@ -140,22 +231,66 @@ class GeoIpMap(object):
     def __get_geodb(self):
         return self._geodb
 
+    def __get_geodb6(self):
+        return self._geodb6
+
     def __get_ips(self):
         return self._ips
 
+    def __get_ips6(self):
+        return self._ips6
+
+    def __get_img(self):
+        return self._img
+
+    def __get_pixels(self):
+        return self._pixels
+
+    def __get_counts(self):
+        return self._counts
+
+    def __get_stats(self):
+        return self._stats
+
+    def __get_cache(self):
+        return self._cache
+
     def __set_geodb(self, geodb_file):
+        self._geodb_file = geodb_file
+        if self._method == 'merge':
+            # Read while looking up the IPs
+            self._geodb = None
+            return
         if (self._verbose):
             print('Unpacking', geodb_file)
-        with open(geodb_file, 'rt') as f:
-            reader = csv.reader(f)
-            self._geodb = list(reader)
+        with self._stats.stage('geodb') as record:
+            self._geodb = GeoIndex.open(geodb_file)
+            record['items'] = len(self._geodb)
+
+    def __set_geodb6(self, geodb6_file):
+        self._geodb6_file = geodb6_file
+        if geodb6_file is None:
+            self._geodb6 = None
+            return
+        if (self._verbose):
+            print('Unpacking', geodb6_file)
+        with self._stats.stage('geodb6') as record:
+            self._geodb6 = GeoIndex6.open(geodb6_file)
+            record['items'] = len(self._geodb6)
 
     def __set_ips(self, ips_file):
+        """Reads the IPs, validated and converted into integers once.
+
+        The IPv4 and IPv6 addresses are kept apart (see `split_ips`).
+        """
+        if ips_file is None:
+            self._ips, self._ips6 = split_ips([])
+            return
         if (self._verbose):
             print('Unpacking', ips_file)
-        with open(ips_file, 'rt') as f:
-            self._ips = f.readlines()
-            self._ips = [x.strip() for x in self._ips]
+        with self._stats.stage('ips') as record, open(ips_file, 'rt') as f:
+            self._ips, self._ips6 = split_ips(f)
+            record['items'] = len(self._ips) + len(self._ips6)
 
     def __set_num_splits(self, num_splits):
         """Sets the number of splits the threading function can do."""
@@ -175,6 +310,7 @@ class GeoIpMap(object):
 
     def __del_ips(self):
         del self._ips
+        del self._ips6
 
     def __del_geodb(self):
         del self._geodb
@@ -188,139 +324,487 @@ class GeoIpMap(object):
         :type lon: float
         :return: Pixel coordinates (`x`, `y`)
         :rtype: pair
+        :see: GeoImage.geo_to_pixel
         """
-        lat_south_rad = math.radians(self._img.s_deg)
-        lat_rad = math.radians(lat)
-        lon_delta = (self._img.e_deg - self._img.w_deg)
-        map_width = (self._img.width / lon_delta) * 360 / (2 * math.pi)
-        offset_y = (map_width /
-                    2 * math.log((1 + math.sin(lat_south_rad)) /
-                                 (1 - math.sin(lat_south_rad))))
-
-        x = (lon - self._img.w_deg) * (self._img.width / lon_delta)
-        y = self._img.height - \
-            ((map_width / 2 * math.log((1 + math.sin(lat_rad)) /
-                                       (1 - math.sin(lat_rad)))) -
-             offset_y)
-
-        return (x, y)
-
-    def __ips_to_pixels_raw(self):
-        """Return a list of pairs (`x`, `y`) from a list of IPs.
-
-        ..note:: This method is very heavy; just for debugging.
-                 The original purpose of this method was to test the
-                 program, but other methods are
-                 `__ips_to_pixels_threading` and
-                 `__ips_to_pixels_multiprocessing`.
-
-        This method check the geoposition of the list of IP using a
-        database file in the format CSV, then translate their
-        (`lon`, `lat`) to the points in a plane.
-
-        :see: self.geo_to_pixel
+        return self._img.geo_to_pixel(lat, lon)
+
+    def geo_to_pixels(self, lats, lons):
+        """Converts arrays of latitudes and longitudes at once.
+
+        :param lats: Latitudes in degrees
+        :type lats: sequence
+        :param lons: Longitudes in degrees
+        :type lons: sequence
+        :return: Pixel coordinates (`x`, `y`) of every point
+        :rtype: list
+        :see: GeoImage.geo_to_pixels
         """
-        if self._verbose:
-            print("Gathering data; this may take a while...")
+        xs, ys = self._img.geo_to_pixels(lats, lons)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def __locate(self, geodb, positions):
+        """Returns the coordinates of the networks at some positions.
+
+        :param geodb: Index where the networks were found
+        :type geodb: GeoIndex
+        :param positions: Positions of the networks in the index (-1 if
+                          none)
+        :type positions: numpy.ndarray
+        :return: Latitudes and longitudes (NaN if no network)
+        :rtype: pair
+        """
+        found = positions >= 0
+        lats = np.full(len(positions), np.nan)
+        lons = np.full(len(positions), np.nan)
+        lats[found] = geodb.lats[positions[found]]
+        lons[found] = geodb.lons[positions[found]]
+        return (lats, lons)
+
+    def __locate6(self, ips):
+        """Finds the networks of a list of IPv6 addresses.
+
+        :param ips: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips: numpy.ndarray
+        :return: Positions of the networks in the IPv6 index (-1 if
+                 none), and their latitudes and longitudes (NaN if none)
+        :rtype: tuple
+        """
+        geodb6 = self._geodb6
+        if geodb6 is None or not len(ips):
+            return (np.full(len(ips), -1, dtype=np.int64),
+                    np.full(len(ips), np.nan), np.full(len(ips), np.nan))
+        ips, inverse = self.__dedup(ips)
+        with self._stats.stage('lookup6', len(ips)):
+            positions = geodb6.lookup_many(ips)[inverse]
+        return (positions,) + self.__locate(geodb6, positions)
+
+    def __dedup(self, ips):
+        """Collapses a list of IPs into its distinct IPs.
+
+        :param ips: IP addresses as integers (or pairs of integers)
+        :type ips: numpy.ndarray
+        :return: Distinct IPs, sorted, and the position of every IP of
+                 the list among them
+        :rtype: pair
+        """
+        with self._stats.stage('dedup', len(ips)):
+            return np.unique(ips, return_inverse=True)
 
-        self._pixels = {self.geo_to_pixel(float(lat), float(lon))
-                        for [nw, lat, lon] in self._geodb
-                        for ip in self._ips
-                        if valid_ipv4(ip) and
-                        IPAddress(ip) in IPNetwork(nw)}
+    def __lookup_raw(self, geodb, ips):
+        """Finds the networks of a list of IPs.
 
-        if self._verbose:
-            print("Data gathered!")
+        This method check the geoposition of the list of IP using the
+        index of the database.
 
-    def __match_geodb(self, start=None, end=None):
-        """Private method to get the pixels for an IP.
-
-        This method check the geoposition of the list of IP using a
-        database file in the format CSV, then translate their
-        (`lon`, `lat`) to the points in a plane.  But instead of
-        searching in the whole database, it looks within a range defined
-        by [`start`, `end`].  It `start` and/or `end` are `None`, then
-        it will be considered repectively the beginning and the end of
-        the list.
-
-        :param start: Where to start in the CSV database
-        :type start: int
-        :param end: Where to end
-        :type start: int
+        :param geodb: Index of the database
+        :type geodb: GeoIndex
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        :return: Positions of the networks in the index (-1 if none)
+        :rtype: numpy.ndarray
         """
-        for nw, lat, lon in self._geodb[start:end]:
-            for ip in self._ips:
-                if valid_ipv4(ip) and IPAddress(ip) in IPNetwork(nw):
-                    self._pixels.add(self.geo_to_pixel(float(lat),
-                                                       float(lon)))
+        if self._verbose:
+            print("Gathering data...")
+        return geodb.lookup_many(ips)
 
-    def __ips_to_pixels_threading(self):
-        """Splits the load of `__match_geodb` to run collectively.
+    def __lookup_threading(self, geodb, ips):
+        """Splits the IP list in chunks looked up by a pool of threads.
 
-        This is the threading version of `ips_to_pixels`
+        This is the threading version of `__lookup_raw`.  The lookup of
+        a chunk (see `GeoIndex.lookup_many`) is done by numpy, which
+        releases the GIL meanwhile, so the threads run at once on
+        several cores.  Unlike the processes, the threads share the
+        index and the IP list with no copy.  Every thread returns the
+        positions of the networks found for its chunk, and those are
+        joined in order of the chunks.
 
-        ..see:: self.__ips_to_pixels_raw
+        ..see:: self.__lookup_raw
         """
         if self._verbose:
-            print("Threading; gathering data; this may take a while...")
-
-        split_size = len(self._geodb) // self._num_splits
-        threads = []
-        for i in range(self._num_splits):
-            start = i * split_size
-            end = None if i + 1 == self._num_splits \
-                else (i + 1) * split_size
-            threads.append(
-                threading.Thread(target=self.__match_geodb,
-                                 args=(start, end)))
-            threads[-1].start()
-
-        for t in threads:
-            t.join()
+            print("Threading; gathering data...")
 
-        if self._verbose:
-            print("Data gathered!")
+        size = max(1, -(-len(ips) // self._num_splits))
+        chunks = [ips[i:i + size] for i in range(0, len(ips), size)]
+        num_threads = min(len(chunks), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max(1, num_threads)) as executor:
+            found = list(executor.map(geodb.lookup_many, chunks))
+
+        return np.concatenate(found) if found \
+            else np.zeros(0, dtype=np.int64)
 
-    def __ips_to_pixels_multiprocessing(self):
-        """Splits the load of `__match_geodb` to run collectively.
+    def __lookup_multiprocessing(self, geodb, ips):
+        """Splits the IP list in shards looked up by a pool of workers.
 
-        This is the multiprocessing version of `ips_to_pixels`
+        This is the multiprocessing version of `__lookup_raw`.  Every
+        worker returns the positions of the networks found for its
+        shard, and those are joined in order of the shards.
 
-        ..see:: self.__ips_to_pixels_raw
+        The index is not pickled for every worker: it is inherited when
+        the processes are forked, or mapped again from its file when it
+        is a compiled database.
+
+        ..see:: self.__lookup_raw
+        """
+        if self._verbose:
+            print("Multiprocessing; gathering data...")
+
+        size = max(1, -(-len(ips) // self._num_workers))
+        shards = [ips[i:i + size] for i in range(0, len(ips), size)]
+        with fork_pool(geodb, self._num_workers) as pool:
+            found = pool.map(call_shared, [('lookup_many', (shard,))
+                                           for shard in shards])
+
+        return np.concatenate(found) if found \
+            else np.zeros(0, dtype=np.int64)
+
+    def __lookup_merge(self, ips):
+        """Joins the sorted IPs with the database while reading it.
+
+        The IPs are sorted, and then the database is read row by row,
+        advancing both sides at once like in a merge join, so it is
+        never loaded in memory.  This requires the networks of the
+        database to be sorted, as it happens in the GeoLite2 databases.
+        The position of a network is its order in the database.
+
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        :return: Positions of the networks (-1 if none), and their
+                 latitudes and longitudes (NaN if none)
+        :rtype: tuple
+        :raises ValueError: If the database is not sorted
         """
         if self._verbose:
-            print("Multiprocessing; gathering data; this may take a while...")
+            print("Merging; gathering data from", self._geodb_file)
+
+        unique, inverse = np.unique(ips, return_inverse=True)
+        positions = np.full(len(unique), -1, dtype=np.int64)
+        lats = np.full(len(unique), np.nan)
+        lons = np.full(len(unique), np.nan)
+        sorted_ips = unique.tolist()
+        i = 0
+        prev_start = -1
+        for n, (start, end, lat, lon) in \
+                enumerate(read_geodb(self._geodb_file)):
+            if start < prev_start:
+                raise ValueError("'{}' is not sorted by network"
+                                 .format(self._geodb_file))
+            prev_start = start
+            i = bisect.bisect_left(sorted_ips, start, i)
+            if i == len(sorted_ips):
+                break
+            j = bisect.bisect_right(sorted_ips, end, i)
+            positions[i:j] = n
+            lats[i:j] = lat
+            lons[i:j] = lon
+            i = j
+
+        return (positions[inverse], lats[inverse], lons[inverse])
+
+    def __lookup(self, ips, parallel=True):
+        """Finds the networks of a list of IPs with the set method.
 
-        workers = []
-        for i in range(self._num_workers):
-            workers.append(multiprocessing.Process(target=self.__match_geodb))
-            workers[-1].start()
+        When the number of workers is one (or less), instead of
+        multiprocessing the calculations, those are made by the *raw*
+        method.  The same happens when using the threading method using
+        one split of the data.  The merge method does not depend on any
+        of them.
+
+        The index is taken once, so all the IPs are looked up in the
+        same one even if the database is refreshed meanwhile (see
+        `refresh`).
+
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        :param parallel: When false, use the *raw* method in any case
+        :type parallel: bool
+        :return: Positions of the networks (-1 if none), and their
+                 latitudes and longitudes (NaN if none)
+        :rtype: tuple
+        """
+        if self._method == 'merge':
+            return self.__lookup_merge(ips)
+        geodb = self._geodb
+        if not parallel or self._num_splits <= 1 or \
+           self._num_workers <= 1 or self._method == 'raw':
+            positions = self.__lookup_raw(geodb, ips)
+        elif self._method == 'threading':
+            positions = self.__lookup_threading(geodb, ips)
+        else:
+            positions = self.__lookup_multiprocessing(geodb, ips)
+        return (positions,) + self.__locate(geodb, positions)
 
-        for worker in workers:
-            worker.join()
+    def __resolve(self, ips, parallel=True):
+        """Finds the networks of a list of IPs, using the cache if any.
 
-        if self._verbose:
-            print("Data gathered!")
+        Every distinct IP is looked up once, however many times it is
+        repeated in the list.  Only the IPs not found in the cache are
+        looked up, and then they are added to the cache.
+
+        :see: self.__lookup
+        """
+        ips, inverse = self.__dedup(ips)
+        with self._stats.stage('lookup', len(ips)):
+            if self._cache is None:
+                found = self.__lookup(ips, parallel)
+            else:
+                with self._cache_lock:
+                    hits, positions, lats, lons = self._cache.get_many(ips)
+                    misses = ~hits
+                    if misses.any():
+                        missed = self.__lookup(ips[misses], parallel)
+                        positions[misses], lats[misses], lons[misses] = \
+                            missed
+                        self._cache.put_many(ips[misses], *missed)
+                found = (positions, lats, lons)
+        return tuple(column[inverse] for column in found)
+
+    def to_counts(self, ips, ips6=None, parallel=True):
+        """Counts the IPs falling in the pixel of every network.
+
+        The IPs are looked up with the method set for this object (see
+        `__lookup`), every distinct IP once.  The IPs are then counted
+        per network, and every network found is projected once, however
+        many IPs it has.  The networks in the same pixel add up their
+        counts.  The IPv6 addresses are looked up in their own index at
+        once.
+
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        :param ips6: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips6: numpy.ndarray
+        :param parallel: When false, use the *raw* method in any case
+        :type parallel: bool
+        :return: Number of IPs (repeated ones included) per pixel
+                 coordinates (`x`, `y`) of the networks found
+        :rtype: collections.Counter
+        """
+        if ips6 is None:
+            ips6 = split_ips([])[1]
+        networks = []
+        for positions, lats, lons in (
+                self.__resolve(np.asarray(ips, dtype=np.uint32), parallel),
+                self.__locate6(ips6)):
+            found, first, counts = np.unique(positions, return_index=True,
+                                             return_counts=True)
+            first, counts = first[found >= 0], counts[found >= 0]
+            networks.append((lats[first], lons[first], counts))
+        lats, lons, counts = (np.concatenate(column)
+                              for column in zip(*networks))
+
+        with self._stats.stage('projection', len(counts)):
+            pixels = self.geo_to_pixels(lats, lons)
+        result = collections.Counter()
+        for pixel, count in zip(pixels, counts.tolist()):
+            result[pixel] += count
+        return result
+
+    def to_pixels(self, ips, ips6=None, parallel=True):
+        """Translates any IPs to the pixels of their networks.
+
+        :return: Pixel coordinates (`x`, `y`) of the networks found
+        :rtype: set
+        :see: self.to_counts
+        """
+        return set(self.to_counts(ips, ips6, parallel))
 
     def ips_to_pixels(self):
-        """Sets the default method for translating IPs to pixels.
+        """Translates the list of IPs to pixels.
 
-        Depending on the class attribute `self._num_splits`, it chooses
-        a method with threading/multiprocessing or without them.
+        The number of IPs of every pixel is kept apart (see `counts`).
 
-        When the number of workers is one (or less), instead of
-        multiprocessing the calculations, those are made by the *raw*
-        method.  The same happens when using the threading method using
-        one split of the data.
+        :see: self.to_counts
         """
-        if self._num_splits <= 1 or self._num_workers <= 1 or \
-           self._method == 'raw':
-            self.__ips_to_pixels_raw()
-        else:
-            if self._method == 'threading':
-                self.__ips_to_pixels_threading()
+        self._counts = self.to_counts(self._ips, self._ips6)
+        self._pixels = set(self._counts)
+
+        if self._verbose:
+            if self._cache is not None:
+                print("Cache: {} hits, {} misses"
+                      .format(self._cache.hits, self._cache.misses))
+            print("Data gathered!")
+
+    def find(self, ips, ips6=None, parallel=True):
+        """Finds the positions of the networks of any IPs.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :param ips6: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips6: numpy.ndarray
+        :param parallel: When false, use the *raw* method in any case
+        :type parallel: bool
+        :return: Positions of the networks of the IPs in `geodb`, and
+                 of the IPv6 addresses in `geodb6` (-1 if none)
+        :rtype: pair
+        """
+        if ips6 is None:
+            ips6 = split_ips([])[1]
+        positions = self.__resolve(np.asarray(ips, dtype=np.uint32),
+                                   parallel)[0]
+        return (positions, self.__locate6(ips6)[0])
+
+    def locate(self, ips, parallel=True):
+        """Finds the location of any IPs, not only the ones of the list.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :param parallel: When false, use the *raw* method in any case
+        :type parallel: bool
+        :return: Mask of the IPs found in the database, and arrays of
+                 their latitudes and longitudes, and their pixel
+                 coordinates `x` and `y` (NaN if not found)
+        :rtype: tuple
+        """
+        positions, lats, lons = self.__resolve(
+            np.asarray(ips, dtype=np.uint32), parallel)
+        with self._stats.stage('projection', len(lats)):
+            xs, ys = self._img.geo_to_pixels(lats, lons)
+        return (positions >= 0, lats, lons, xs, ys)
+
+    def locate6(self, ips6):
+        """Finds the location of any IPv6 addresses.
+
+        :param ips6: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips6: numpy.ndarray
+        :return: Mask of the IPs found in the IPv6 database, and arrays
+                 of their latitudes and longitudes, and their pixel
+                 coordinates `x` and `y` (NaN if not found)
+        :rtype: tuple
+        """
+        positions, lats, lons = self.__locate6(ips6)
+        with self._stats.stage('projection', len(lats)):
+            xs, ys = self._img.geo_to_pixels(lats, lons)
+        return (positions >= 0, lats, lons, xs, ys)
+
+    def update(self, ips):
+        """Adds some IPs to the list and their pixels to the ones found.
+
+        Unlike `ips_to_pixels`, only the given IPs are looked up, and
+        the pixels already found are kept; the counts of the IPs,
+        repeated ones included (as in `to_counts`), are added to the
+        ones of their pixels.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :return: Pixel coordinates (`x`, `y`) not found before
+        :rtype: set
+        """
+        ips = np.asarray(ips, dtype=np.uint32)
+        counts = self.to_counts(ips, parallel=False)
+        pixels = set(counts) - self._pixels
+        self._pixels |= pixels
+        self._counts.update(counts)
+        self.__append_ips(ips)
+        return pixels
+
+    def __append_ips(self, ips):
+        """Appends some IPs to the list.
+
+        The list is a view of a larger buffer, whose size is doubled
+        when it is full, so appending many small chunks (e.g., from a
+        stream) copies every IP only a few times in total.
+
+        :param ips: IP addresses as integers
+        :type ips: numpy.ndarray
+        """
+        count = len(self._ips)
+        buf = self._ips_buffer
+        if buf is None or self._ips.base is not buf or \
+           count + len(ips) > len(buf):
+            buf = np.empty(max(2 * (count + len(ips)), 1024), dtype=np.uint32)
+            buf[:count] = self._ips
+            self._ips_buffer = buf
+        buf[count:count + len(ips)] = ips
+        self._ips = buf[:count + len(ips)]
+
+    def refresh(self, patch):
+        """Updates the database to a new version with a patch.
+
+        The patch is applied aside to the loaded index (see
+        `GeoPatch.apply`), and then the new index replaces the old one
+        at once, so the lookups running meanwhile finish with the old
+        one, and the next ones use the new one.  The patch applies to
+        the IPv4 or the IPv6 index, depending on its networks.  The
+        cache, if any, is emptied, as the positions of the networks
+        change.
+
+        :param patch: Patch, or path of a patch file
+        :type patch: GeoPatch
+        :raises ValueError: If the database is not loaded (merge method)
+                            or the patch does not apply to it
+        """
+        if not isinstance(patch, GeoPatch):
+            patch = GeoPatch.load(patch)
+        ipv6 = isinstance(patch.added, GeoIndex6)
+        geodb = self._geodb6 if ipv6 else self._geodb
+        if geodb is None:
+            raise ValueError("There is no database loaded to refresh")
+        if self._verbose:
+            print('Refreshing with', patch)
+
+        with self._stats.stage('refresh', len(patch)):
+            geodb = patch.apply(geodb)
+        with self._cache_lock:
+            if ipv6:
+                self._geodb6 = geodb
             else:
-                self.__ips_to_pixels_multiprocessing()
+                # Emptied before the swap, so if it fails, the old index
+                # is kept with the locations cached from it
+                if self._cache is not None:
+                    self._cache.clear()
+                self._geodb = geodb
+
+    def locations(self):
+        """Returns the location of every IP found in the database.
+
+        Unlike `ips_to_pixels`, the IPs are not grouped by network, and
+        they are kept in the same order of the list.
+        Only the IPv4 addresses are returned (see `locations6`).
+
+        :return: Arrays of the IPs (as integers) found, their latitudes
+                 and longitudes, and their pixel coordinates `x` and `y`
+        :rtype: tuple
+        """
+        found, lats, lons, xs, ys = self.locate(self._ips)
+        return (self._ips[found], lats[found], lons[found],
+                xs[found], ys[found])
+
+    def locations6(self):
+        """Returns the location of every IPv6 address found.
+
+        :return: Arrays of the IPv6 addresses (as pairs `hi`, `lo`)
+                 found, their latitudes and longitudes, and their pixel
+                 coordinates `x` and `y`
+        :rtype: tuple
+        :see: self.locations
+        """
+        found, lats, lons, xs, ys = self.locate6(self._ips6)
+        return (self._ips6[found], lats[found], lons[found],
+                xs[found], ys[found])
+
+    def export(self, output):
+        """Writes the location of every IP found as CSV.
+
+        The columns are 'ip,lat,lon,x,y'.  The IPv4 addresses are
+        written first, and then the IPv6 ones, each in the order of the
+        list.
+
+        :param output: Path of the CSV file, or an open file
+        :type output: str
+        :see: self.locations
+        """
+        if not hasattr(output, 'write'):
+            with open(output, 'wt', newline='') as f:
+                return self.export(f)
+
+        if self._verbose:
+            print('Exporting locations')
+        writer = csv.writer(output)
+        writer.writerow(['ip', 'lat', 'lon', 'x', 'y'])
+        ips, lats, lons, xs, ys = self.locations()
+        write_locations(writer, map(int_to_ip, ips.tolist()),
+                        lats, lons, xs, ys)
+        ips6, lats, lons, xs, ys = self.locations6()
+        write_locations(writer, ipv6_to_ips(ips6), lats, lons, xs, ys)
 
     def plot(self, radius=None):
         """Plot coordinates from a list of pairs (`x`, `y`) as circles.
@@ -347,21 +831,25 @@ class GeoIpMap(object):
         :param radius: radius in pixels of the circles
         :type radius: float
         """
+        # Imported here, so using only the lookups is fast
+        import matplotlib.collections
+        import matplotlib.image
+        import matplotlib.patches
+        import matplotlib.pyplot as plt
+
         if not radius:
-            radius = 0.003 * self._img.width \
-                if self._img.width > self._img.height \
-                else 0.003 * self._img.height
+            radius = default_radius(self._img)
 
-        img = matplotlib.image.imread(self._img.filepath)
-        fig, ax = plt.subplots(1)
-        ax.set_aspect('equal')
-        ax.imshow(img)
+        with self._stats.stage('render', len(self._pixels)):
+            img = matplotlib.image.imread(self._img.filepath)
+            fig, ax = plt.subplots(1)
+            ax.set_aspect('equal')
+            ax.imshow(img)
 
-        for x, y in self._pixels:
-            circ = matplotlib.patches.Circle((x, y), radius,
-                                             facecolor='red',
-                                             edgecolor='black')
-            ax.add_patch(circ)
+            circles = [matplotlib.patches.Circle((x, y), radius)
+                       for x, y in self._pixels]
+            ax.add_collection(matplotlib.collections.PatchCollection(
+                circles, facecolor='red', edgecolor='black'))
 
         # Show the image
         plt.axis('off')
@@ -370,11 +858,94 @@ class GeoIpMap(object):
             print('Plotting')
         plt.show()
 
+    def density(self, cell_size=1, chunk_size=65536):
+        """Counts how many IPs fall in every cell of the image.
+
+        Unlike `ips_to_pixels`, every IP is counted, even if many of
+        them share the same location.  The IPs are looked up and
+        projected in chunks, so the memory used does not grow with the
+        number of IPs, but with the size of the grid.
+
+        :param cell_size: Side of the cells in pixels
+        :type cell_size: int
+        :param chunk_size: IPs looked up at once
+        :type chunk_size: int
+        :return: Grid of counts
+        :rtype: GeoDensity
+        :raises ValueError: If the database is not loaded (merge method)
+        """
+        if self._geodb is None:
+            raise ValueError("The density needs the database loaded; "
+                             "it cannot be used with method 'merge'")
+        if self._verbose:
+            print("Counting IPs per cell of {} pixels".format(cell_size))
+
+        density = GeoDensity(self._img, cell_size)
+        for i in range(0, len(self._ips), chunk_size):
+            positions, lats, lons = self.__resolve(self._ips[i:i + chunk_size],
+                                                   parallel=False)
+            found = positions >= 0
+            with self._stats.stage('projection', int(found.sum())):
+                density.add(*self._img.geo_to_pixels(lats[found],
+                                                     lons[found]))
+        for i in range(0, len(self._ips6), chunk_size):
+            positions, lats, lons = self.__locate6(
+                self._ips6[i:i + chunk_size])
+            found = positions >= 0
+            with self._stats.stage('projection', int(found.sum())):
+                density.add(*self._img.geo_to_pixels(lats[found],
+                                                     lons[found]))
+        return density
+
+    def render_density(self, output_file, cell_size=4, cmap='hot'):
+        """Writes the image with the density of IPs as a heat layer.
+
+        :param output_file: Path of the output image
+        :type output_file: str
+        :param cell_size: Side of the cells in pixels
+        :type cell_size: int
+        :param cmap: Name of the matplotlib colormap
+        :type cmap: str
+        :see: self.density
+        """
+        density = self.density(cell_size)
+        if self._verbose:
+            print('Rendering', output_file)
+        with self._stats.stage('render', density.total):
+            raster = GeoRaster(self._img)
+            raster.save(raster.render_density(density, cmap), output_file)
+
+    def render(self, output_file, radius=None):
+        """Writes the image with the pixels stamped as circles.
+
+        Unlike `plot`, the circles are stamped directly into the pixels
+        of the image (see `GeoRaster`), so it does not need a display
+        and it is much faster for many points.  The format of the output
+        (PNG, JPEG, ...) is given by the extension of `output_file`.
+
+        :param output_file: Path of the output image
+        :type output_file: str
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        """
+        if self._verbose:
+            print('Rendering', output_file)
+        with self._stats.stage('render', len(self._pixels)):
+            raster = GeoRaster(self._img)
+            raster.save(raster.render(self._pixels, radius), output_file)
+
     # Properties
     num_splits = property(__get_num_splits, __set_num_splits)
     num_workers = property(__get_num_workers, __set_num_workers)
     ips = property(__get_ips, __set_ips, __del_ips)
     geodb = property(__get_geodb, __set_geodb, __del_geodb)
+    geodb6 = property(__get_geodb6, __set_geodb6)
+    ips6 = property(__get_ips6)
+    img = property(__get_img)
+    pixels = property(__get_pixels)
+    counts = property(__get_counts)
+    stats = property(__get_stats)
+    cache = property(__get_cache)
 
     # Class printing
     def __repr__(self):
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Differences between two versions of a database, to update an index"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+from geoipmap.geoindex import COMPILED_MAGIC
+from geoipmap.geoindex import COMPILED_MAGIC6
+from geoipmap.geoindex import GeoIndex
+from geoipmap.geoindex import GeoIndex6
+import mmap
+import numpy as np
+import os
+import struct
+
+
+# Patch format: header (magic, version, magic of the kind of index,
+# number of networks removed and added) followed by the columns of the
+# networks removed and then the ones of the networks added
+PATCH_MAGIC = b'GEOPATCH'
+PATCH_VERSION = 1
+PATCH_EXT = '.patch'
+_HEADER = struct.Struct('<8sI8sII')
+_INDEXES = {COMPILED_MAGIC: GeoIndex, COMPILED_MAGIC6: GeoIndex6}
+
+
+def _isin(index, other):
+    """Returns the mask of the networks of an index found, with the
+    same bounds and coordinates, in another index.
+
+    As the networks do not overlap, every network can only be the one
+    with the same start in the other index, which is found by a binary
+    search.
+
+    :param index: Index whose networks are looked for
+    :type index: GeoIndex
+    :param other: Index where the networks are looked for
+    :type other: GeoIndex
+    :rtype: numpy.ndarray
+    """
+    if not len(other):
+        return np.zeros(len(index), dtype=bool)
+    starts = index.sortable(index.starts)
+    other_starts = other.sortable(other.starts)
+    pos = np.minimum(np.searchsorted(other_starts, starts), len(other) - 1)
+    found = other_starts[pos] == starts
+    for column, other_column in zip(index.columns()[1:],
+                                    other.columns()[1:]):
+        found &= column == other_column[pos]
+    return found
+
+
+class GeoPatch(object):
+    """Networks removed and added between two versions of a database.
+
+    A new version of a GeoLite2 database changes only a part of its
+    networks.  The patch keeps only those: the networks of the old
+    version not in the new one (removed), and the networks of the new
+    version not in the old one (added), where a network changes when
+    any of its bounds or its coordinates change.
+
+    The patch is computed once (see `diff`), and applying it to an
+    index of the old version (see `apply`) gives an index of the new
+    version with no parsing at all.
+    """
+    def __init__(self, removed, added):
+        """Patch from the networks removed and added:
+
+        :param removed: Networks of the old version not in the new one
+        :type removed: GeoIndex
+        :param added: Networks of the new version not in the old one
+        :type added: GeoIndex
+        """
+        self._removed = removed
+        self._added = added
+
+    @classmethod
+    def diff(cls, old, new):
+        """Computes the patch between two versions of a database.
+
+        :param old: Index of the old version
+        :type old: GeoIndex
+        :param new: Index of the new version
+        :type new: GeoIndex
+        :return: The patch turning `old` into `new`
+        :rtype: GeoPatch
+        :raises ValueError: If the indexes are of different kinds
+        """
+        if type(old) is not type(new):
+            raise ValueError("Cannot diff a {} with a {}"
+                             .format(type(old).__name__,
+                                     type(new).__name__))
+        removed = ~_isin(old, new)
+        added = ~_isin(new, old)
+        return cls(type(old)(*(column[removed] for column in old.columns())),
+                   type(new)(*(column[added] for column in new.columns())))
+
+    @classmethod
+    def load(cls, patch_file):
+        """Reads a patch (see `save`).
+
+        :param patch_file: Path of the patch
+        :type patch_file: str
+        :return: The patch
+        :rtype: GeoPatch
+        :raises ValueError: If the file is not a valid patch
+        """
+        with open(patch_file, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < _HEADER.size:
+            raise ValueError("'{}' is not a geodb patch".format(patch_file))
+        magic, version, kind, removed, added = _HEADER.unpack_from(buf)
+        if magic != PATCH_MAGIC or kind not in _INDEXES:
+            raise ValueError("'{}' is not a geodb patch".format(patch_file))
+        if version != PATCH_VERSION:
+            raise ValueError("'{}' has an unsupported version ({})"
+                             .format(patch_file, version))
+        index_class = _INDEXES[kind]
+        row_size = index_class.row_size()
+        if len(buf) < _HEADER.size + (removed + added) * row_size:
+            raise ValueError("'{}' is truncated".format(patch_file))
+
+        return cls(index_class.from_buffer(buf, removed, _HEADER.size),
+                   index_class.from_buffer(buf, added, _HEADER.size +
+                                           removed * row_size))
+
+    def save(self, patch_file):
+        """Writes the patch.
+
+        :param patch_file: Path of the patch
+        :type patch_file: str
+        """
+        kind = COMPILED_MAGIC6 if isinstance(self._added, GeoIndex6) \
+            else COMPILED_MAGIC
+        tmp_file = patch_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_HEADER.pack(PATCH_MAGIC, PATCH_VERSION, kind,
+                                 len(self._removed), len(self._added)))
+            self._removed.write(f)
+            self._added.write(f)
+        os.replace(tmp_file, patch_file)
+
+    def apply(self, index):
+        """Applies the patch to an index of the old version.
+
+        The index is not modified: the networks kept are copied once,
+        and the ones added are inserted in their place, so there is no
+        sorting.
+
+        :param index: Index of the old version
+        :type index: GeoIndex
+        :return: Index of the new version
+        :rtype: GeoIndex
+        :raises ValueError: If the patch does not apply to the index
+        """
+        if type(index) is not type(self._added):
+            raise ValueError("Cannot apply a patch of a {} to a {}"
+                             .format(type(self._added).__name__,
+                                     type(index).__name__))
+        keep = ~_isin(index, self._removed)
+        if len(index) - int(keep.sum()) != len(self._removed):
+            raise ValueError("The patch does not apply to {}".format(index))
+
+        kept = [column[keep] for column in index.columns()]
+        at = np.searchsorted(index.sortable(kept[0]),
+                             index.sortable(self._added.starts))
+        return type(index)(*(np.insert(column, at, added) for column, added
+                             in zip(kept, self._added.columns())))
+
+    def __get_removed(self):
+        return self._removed
+
+    def __get_added(self):
+        return self._added
+
+    def __len__(self):
+        return len(self._removed) + len(self._added)
+
+    # Properties
+    removed = property(__get_removed)
+    added = property(__get_added)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoPatch(-{} +{} networks)".format(len(self._removed),
+                                                   len(self._added))
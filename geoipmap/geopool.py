@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Pools of processes sharing an object with their workers"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import multiprocessing
+
+
+# Object shared by the workers of the pool
+_shared = None
+
+
+def _init_worker(obj):
+    """Sets the object shared by a worker.
+
+    When the processes are forked, the object is inherited and not
+    pickled, so the workers share its pages with the parent.
+    """
+    global _shared
+    _shared = obj
+
+
+def can_fork():
+    """Returns whether the processes of a pool may be forked."""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def fork_pool(obj, processes):
+    """Returns a pool of processes whose workers see an object.
+
+    The processes are forked when the platform allows it; otherwise the
+    object is pickled once for every worker.  The methods of the object
+    are called in the workers with `call_shared`.
+
+    :param obj: Object shared by the workers
+    :type obj: object
+    :param processes: Number of workers
+    :type processes: int
+    :return: Pool of processes
+    :rtype: multiprocessing.pool.Pool
+    """
+    if can_fork():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return context.Pool(processes, initializer=_init_worker,
+                        initargs=(obj,))
+
+
+def call_shared(job):
+    """Calls a method of the object shared (in a worker).
+
+    :param job: Name of the method and its arguments
+    :type job: tuple
+    :return: Result of the method
+    """
+    name, args = job
+    return getattr(_shared, name)(*args)
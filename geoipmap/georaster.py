@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Raster rendering of points stamped directly into the map image"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import math
+import numpy as np
+
+
+def default_radius(img):
+    """Returns the default radius of the markers for an image.
+
+    The radius is the 0.3% of the largest dimension of the image.
+
+    :param img: Image object with information to plot
+    :type img: GeoImage
+    :return: Radius in pixels
+    :rtype: float
+    """
+    return 0.003 * max(img.width, img.height)
+
+
+def disk_offsets(radius):
+    """Returns the offsets of the pixels within a disk.
+
+    :param radius: Radius of the disk in pixels
+    :type radius: float
+    :return: Arrays of offsets (`dx`, `dy`) from the center
+    :rtype: pair
+    """
+    r = int(math.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx * dx + dy * dy <= radius * radius
+    return (dx[inside], dy[inside])
+
+
+class GeoRaster(object):
+    """Raster of the map image where the markers are stamped directly.
+
+    The image is decoded only once, the first time it is needed, and
+    every rendering is done over a copy of it, so no figure nor GUI
+    backend is involved and the same object may render many outputs.
+    `matplotlib` is only imported to decode and encode the images.
+    """
+    def __init__(self, img):
+        """Raster for a geo image:
+
+        :param img: Image object with information to plot
+        :type img: GeoImage
+        """
+        self._img = img
+        self._base = None
+
+    def __get_img(self):
+        return self._img
+
+    def __get_base(self):
+        """Returns the decoded image as an array of RGBA bytes."""
+        if self._base is None:
+            import matplotlib.image
+            base = matplotlib.image.imread(self._img.filepath)
+            if base.dtype != np.uint8:
+                base = np.rint(base * 255).astype(np.uint8)
+            if base.ndim == 2:
+                base = np.dstack([base] * 3)
+            if base.shape[2] == 3:
+                alpha = np.full(base.shape[:2] + (1,), 255, dtype=np.uint8)
+                base = np.concatenate([base, alpha], axis=2)
+            base.setflags(write=False)
+            self._base = base
+        return self._base
+
+    @staticmethod
+    def stamp(buf, xs, ys, radius, color):
+        """Stamps filled disks of a color into an image buffer.
+
+        Every offset of the disk is painted for all the points at once,
+        and the points falling in the same pixel are stamped only once.
+
+        :param buf: Image as an array of RGBA bytes (modified)
+        :type buf: numpy.ndarray
+        :param xs: Horizontal pixel coordinates of the centers
+        :type xs: sequence
+        :param ys: Vertical pixel coordinates of the centers
+        :type ys: sequence
+        :param radius: Radius of the disks in pixels
+        :type radius: float
+        :param color: RGB color as bytes
+        :type color: tuple
+        """
+        height, width = buf.shape[:2]
+        cx = np.rint(np.asarray(xs, dtype=np.float64)).astype(np.intp)
+        cy = np.rint(np.asarray(ys, dtype=np.float64)).astype(np.intp)
+        cx, cy = np.unique(np.stack([cx, cy], axis=1), axis=0).T
+        rgba = tuple(color) + (255,)
+        for dx, dy in zip(*disk_offsets(radius)):
+            px = cx + dx
+            py = cy + dy
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            buf[py[inside], px[inside]] = rgba
+
+    def render(self, pixels, radius=None,
+               facecolor=(255, 0, 0), edgecolor=(0, 0, 0)):
+        """Renders the markers of some points over the map image.
+
+        :param pixels: Pixel coordinates (`x`, `y`) of the points
+        :type pixels: iterable
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        :param facecolor: RGB color of the circles as bytes
+        :type facecolor: tuple
+        :param edgecolor: RGB color of the border of the circles
+        :type edgecolor: tuple
+        :return: Image as an array of RGBA bytes
+        :rtype: numpy.ndarray
+        """
+        buf = self.base.copy()
+        self.draw(buf, pixels, radius, facecolor, edgecolor)
+        return buf
+
+    def draw(self, buf, pixels, radius=None,
+             facecolor=(255, 0, 0), edgecolor=(0, 0, 0)):
+        """Draws the markers of some points over an image buffer.
+
+        Unlike `render`, the markers are drawn over the given buffer,
+        so it may be used to add markers to an image already rendered.
+
+        :param buf: Image as an array of RGBA bytes (modified)
+        :type buf: numpy.ndarray
+        :see: self.render
+        """
+        if not radius:
+            radius = default_radius(self._img)
+        pixels = np.asarray(list(pixels), dtype=np.float64).reshape(-1, 2)
+        if len(pixels):
+            xs, ys = pixels[:, 0], pixels[:, 1]
+            self.stamp(buf, xs, ys, radius, edgecolor)
+            self.stamp(buf, xs, ys, max(radius - 1, 0.5), facecolor)
+
+    def render_density(self, density, cmap='hot', alpha=0.8):
+        """Renders a grid of counts as a heat layer over the map image.
+
+        The counts are colored in logarithmic scale, so the locations
+        with few points remain visible beside the ones with many, and
+        the empty cells are left transparent.
+
+        :param density: Grid of counts
+        :type density: GeoDensity
+        :param cmap: Name of the matplotlib colormap
+        :type cmap: str
+        :param alpha: Opacity of the heat layer, in [0, 1]
+        :type alpha: float
+        :return: Image as an array of RGBA bytes
+        :rtype: numpy.ndarray
+        """
+        buf = self.base.copy()
+        size = density.cell_size
+        grid = np.repeat(np.repeat(density.grid, size, axis=0), size, axis=1)
+        height = min(buf.shape[0], grid.shape[0])
+        width = min(buf.shape[1], grid.shape[1])
+        counts = grid[:height, :width]
+        mask = counts > 0
+        if not mask.any():
+            return buf
+
+        import matplotlib
+        levels = np.log1p(counts[mask]) / np.log1p(counts.max())
+        colors = matplotlib.colormaps[cmap](levels, bytes=True)
+        layer = buf[:height, :width]
+        layer[mask, :3] = np.rint(alpha * colors[:, :3] +
+                                  (1 - alpha) * layer[mask, :3])
+        layer[mask, 3] = 255
+        return buf
+
+    @staticmethod
+    def save(buf, filepath, fmt=None):
+        """Writes an image buffer to a file (PNG, JPEG, ...).
+
+        The format is given by the extension of the file, unless `fmt`
+        is set.
+
+        :param buf: Image as an array of RGBA bytes
+        :type buf: numpy.ndarray
+        :param filepath: Path of the output image, or an open file
+        :type filepath: str
+        :param fmt: Format of the image, such as 'png' or 'jpeg'
+        :type fmt: str
+        """
+        import matplotlib.image
+        matplotlib.image.imsave(filepath, buf, format=fmt)
+
+    # Properties
+    img = property(__get_img)
+    base = property(__get_base)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoRaster({!r})".format(self._img)
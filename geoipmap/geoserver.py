@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Resident server answering batches of IP lookups (asyncio)
+
+The protocol is one JSON object per line, in both directions.  Every
+request has a list of IPs, and optionally an identifier and whether to
+render the map with those IPs:
+
+    {"id": 1, "ips": ["77.247.181.162", "198.98.56.149"], "render": true}
+
+and every response has, in the same order of the request, the location
+of every IP (or `null` if it is not found), and the rendered map as a
+PNG image encoded in base64, if requested:
+
+    {"id": 1, "results": [{"ip": "77.247.181.162", "lat": 52.3824,
+                           "lon": 4.8995, "x": 1053.1, "y": 505.9},
+                          null], "image": "iVBORw0KGgo..."}
+
+The requests of a connection may be pipelined (sent without waiting for
+the previous responses), and they are answered in order.
+
+A request may also ask to refresh the database with a patch file (see
+`GeoPatch`), which is applied while the other requests are answered:
+
+    {"id": 2, "refresh": "data/geoip_ipv4.patch"}
+
+and the response tells when the new database is in use:
+
+    {"id": 2, "refreshed": true}
+"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import asyncio
+import base64
+from geoipmap.georaster import GeoRaster
+from geoipmap.ipparse import ints_to_ipv6
+from geoipmap.ipparse import ip6_to_int
+from geoipmap.ipparse import ip_to_int
+import io
+import json
+import sqlite3
+
+
+# Longest line, in bytes, of a request or a response (asyncio reads at
+# most 64 KiB by default, which a batch of a thousand IPs or a rendered
+# map already exceeds)
+LINE_LIMIT = 256 << 20
+
+
+class GeoServer(object):
+    """Server keeping a `GeoIpMap` loaded to answer lookups.
+
+    The database is loaded and the map image is decoded only once, and
+    the clients are handled concurrently by an asyncio event loop, with
+    no thread per client.
+    """
+    def __init__(self, geo, radius=None, limit=LINE_LIMIT):
+        """Server for an already loaded `GeoIpMap`:
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param radius: radius in pixels of the circles when rendering
+        :type radius: float
+        :param limit: Longest request line, in bytes
+        :type limit: int
+        """
+        self._geo = geo
+        self._radius = radius
+        self._limit = limit
+        self._raster = GeoRaster(geo.img)
+        self._server = None
+
+    def query(self, ips):
+        """Finds the location of a batch of IPs.
+
+        The IPv6 addresses are looked up in the IPv6 database of the
+        `GeoIpMap`, if any.
+
+        :param ips: IP addresses as strings
+        :type ips: list
+        :return: Location of every IP as a dictionary with the keys
+                 'ip', 'lat', 'lon', 'x' and 'y', or `None`
+        :rtype: list
+        """
+        values, values6 = [], []
+        for ip in ips:
+            value = ip_to_int(ip) if isinstance(ip, str) else None
+            value6 = ip6_to_int(ip) if isinstance(ip, str) and \
+                value is None else None
+            if value6 is not None and value6 >> 32 == 0xffff:
+                # IPv4 mapped into IPv6, taken as IPv4 (see `split_ips`)
+                value, value6 = value6 & 0xffffffff, None
+            values.append(value)
+            values6.append(value6)
+        valid = [value for value in values if value is not None]
+        valid6 = [value for value in values6 if value is not None]
+        located = zip(*(column.tolist() for column in
+                        self._geo.locate(valid, parallel=False)))
+        located6 = zip(*(column.tolist() for column in
+                         self._geo.locate6(ints_to_ipv6(valid6))))
+        results = []
+        for ip, value, value6 in zip(ips, values, values6):
+            if value is not None:
+                hit, lat, lon, x, y = next(located)
+            elif value6 is not None:
+                hit, lat, lon, x, y = next(located6)
+            else:
+                results.append(None)
+                continue
+            results.append({'ip': ip, 'lat': round(lat, 4),
+                            'lon': round(lon, 4), 'x': round(x, 3),
+                            'y': round(y, 3)} if hit else None)
+        return results
+
+    def render(self, results):
+        """Renders the map with the IPs found in a batch.
+
+        :param results: Locations returned by `query`
+        :type results: list
+        :return: PNG image
+        :rtype: bytes
+        """
+        buf = self._raster.render({(r['x'], r['y']) for r in results if r},
+                                  self._radius)
+        with io.BytesIO() as f:
+            self._raster.save(buf, f, fmt='png')
+            return f.getvalue()
+
+    async def answer(self, line):
+        """Answers a request (a line of JSON).
+
+        :param line: Request
+        :type line: bytes
+        :return: Response
+        :rtype: dict
+        """
+        try:
+            request = json.loads(line)
+            if 'refresh' in request:
+                return await self.refresh(request)
+            ips = request['ips']
+            if not isinstance(ips, list):
+                raise TypeError("'ips' must be a list")
+        except (ValueError, KeyError, TypeError) as e:
+            return {'id': None, 'error': 'Bad request: {}'.format(e)}
+
+        response = {'id': request.get('id'), 'results': self.query(ips)}
+        if request.get('render'):
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(None, self.render,
+                                               response['results'])
+            response['image'] = base64.b64encode(image).decode('ascii')
+        return response
+
+    async def refresh(self, request):
+        """Refreshes the database with the patch file of a request.
+
+        The patch is applied in another thread, so the event loop keeps
+        answering the lookups with the current database meanwhile.
+
+        :param request: Request with the path of the patch
+        :type request: dict
+        :return: Response
+        :rtype: dict
+        """
+        patch_file = request['refresh']
+        if not isinstance(patch_file, str):
+            raise TypeError("'refresh' must be a path")
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._geo.refresh, patch_file)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            return {'id': request.get('id'),
+                    'error': 'Refresh failed: {}'.format(e)}
+        return {'id': request.get('id'), 'refreshed': True}
+
+    async def handle(self, reader, writer):
+        """Answers the requests of a connection, in order.
+
+        A request longer than the limit is answered with an error, and
+        the connection is closed, as the rest of that line cannot be
+        told apart from the next requests.
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError) as e:
+                    response = {'id': None,
+                                'error': 'Bad request: {}'.format(e)}
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.answer(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path=None, host='127.0.0.1', port=None):
+        """Starts listening on a Unix socket or on a TCP port.
+
+        :param path: Path of the Unix socket
+        :type path: str
+        :param host: Host to listen on, when using TCP
+        :type host: str
+        :param port: TCP port to listen on, if no Unix socket is used
+        :type port: int
+        :return: The asyncio server
+        :rtype: asyncio.AbstractServer
+        """
+        if path:
+            self._server = await asyncio.start_unix_server(
+                self.handle, path, limit=self._limit)
+        else:
+            self._server = await asyncio.start_server(
+                self.handle, host, port, limit=self._limit)
+        return self._server
+
+    def serve(self, path=None, host='127.0.0.1', port=None):
+        """Serves forever on a Unix socket or on a TCP port.
+
+        :see: self.start
+        """
+        async def run():
+            server = await self.start(path, host, port)
+            async with server:
+                await server.serve_forever()
+
+        asyncio.run(run())
+
+    # Class printing
+    def __repr__(self):
+        return "GeoServer({!r})".format(self._geo._geodb)
+
+
+class GeoClient(object):
+    """Client of a `GeoServer`."""
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+
+    @classmethod
+    async def connect(cls, path=None, host='127.0.0.1', port=None,
+                      limit=LINE_LIMIT):
+        """Connects to a server on a Unix socket or on a TCP port.
+
+        :param limit: Longest response line, in bytes (a rendered map
+                      is a single line)
+        :type limit: int
+        :see: GeoServer.start
+        """
+        if path:
+            reader, writer = await asyncio.open_unix_connection(
+                path, limit=limit)
+        else:
+            reader, writer = await asyncio.open_connection(
+                host, port, limit=limit)
+        return cls(reader, writer)
+
+    async def query_many(self, batches, render=False):
+        """Sends many batches of IPs at once and waits for the answers.
+
+        All the requests are written before reading any response
+        (pipelining), so there is no round trip per batch.
+
+        :param batches: Lists of IP addresses as strings
+        :type batches: iterable
+        :param render: When true, ask for the rendered maps as well
+        :type render: bool
+        :return: Responses of the server, in order
+        :rtype: list
+        """
+        count = 0
+        for ips in batches:
+            self._next_id += 1
+            request = {'id': self._next_id, 'ips': list(ips)}
+            if render:
+                request['render'] = True
+            self._writer.write(json.dumps(request).encode() + b'\n')
+            count += 1
+        await self._writer.drain()
+        return [json.loads(await self._reader.readline())
+                for _ in range(count)]
+
+    async def query(self, ips, render=False):
+        """Sends a batch of IPs and waits for the answer.
+
+        :see: self.query_many
+        """
+        return (await self.query_many([ips], render))[0]
+
+    async def refresh(self, patch_file):
+        """Asks the server to refresh its database with a patch file.
+
+        :param patch_file: Path of the patch, as seen by the server
+        :type patch_file: str
+        :return: Response of the server
+        :rtype: dict
+        """
+        self._next_id += 1
+        request = {'id': self._next_id, 'refresh': patch_file}
+        self._writer.write(json.dumps(request).encode() + b'\n')
+        await self._writer.drain()
+        return json.loads(await self._reader.readline())
+
+    async def close(self):
+        """Closes the connection."""
+        self._writer.close()
+        await self._writer.wait_closed()
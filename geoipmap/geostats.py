@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Instrumentation of the stages of the lookups and rendering"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Returns the peak resident memory of the process, in bytes.
+
+    :return: Peak resident memory, or `None` if it is not available
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def profiler_hook(profiler, stages=None):
+    """Returns a hook enabling a profiler only within some stages.
+
+    :param profiler: Profiler, such as `cProfile.Profile()`
+    :type profiler: cProfile.Profile
+    :param stages: Names of the stages to profile (all if `None`)
+    :type stages: iterable
+    :return: Hook for `GeoStats.add_hook`
+    :rtype: callable
+    """
+    # Stages running, as they nest
+    running = [0]
+
+    def hook(event, name, record):
+        if stages is None or name in stages:
+            if event == 'start':
+                running[0] += 1
+                if running[0] == 1:
+                    profiler.enable()
+            else:
+                running[0] -= 1
+                if running[0] == 0:
+                    profiler.disable()
+    return hook
+
+
+class GeoStats(object):
+    """Wall time, CPU time, memory and items of every stage.
+
+    Every stage may run many times, and its records are accumulated.
+    The hooks are called at the start and at the end of every stage
+    with the event ('start' or 'end'), the name of the stage and its
+    record, so a profiler or a metrics exporter may be attached.
+
+    The peak memory is how much the peak resident memory of the process
+    grew during the stage (zero if it stayed below an earlier peak),
+    unless `trace_memory` is set: then it is the peak of the memory
+    allocated within the stage over the memory allocated at its start,
+    traced by `tracemalloc` (which is much more precise, but slows down
+    everything).  The stages may nest: the peak of an outer stage
+    includes the ones of the stages within it.
+    """
+    def __init__(self, trace_memory=False):
+        """Empty statistics:
+
+        :param trace_memory: When true, trace the memory of every stage
+        :type trace_memory: bool
+        """
+        self._trace_memory = trace_memory
+        self._records = {}
+        self._hooks = []
+        # Memory at the start and peak so far of every stage running
+        self._traced = []
+
+    def __get_records(self):
+        return self._records
+
+    def add_hook(self, hook):
+        """Adds a function to call at the start and end of the stages.
+
+        :param hook: Function of the event, the stage and its record
+        :type hook: callable
+        """
+        self._hooks.append(hook)
+
+    @contextlib.contextmanager
+    def stage(self, name, items=None):
+        """Measures a stage within a `with` block.
+
+        The number of items may be given beforehand, or set within the
+        block in the key 'items' of the record returned.
+
+        :param name: Name of the stage
+        :type name: str
+        :param items: Number of items processed
+        :type items: int
+        :return: Record of this run of the stage
+        :rtype: dict
+        """
+        record = {'items': items}
+        for hook in self._hooks:
+            hook('start', name, record)
+        if self._trace_memory:
+            self.__start_tracing()
+        else:
+            rss = peak_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            if self._trace_memory:
+                record['peak_memory'] = self.__stop_tracing()
+            elif rss is not None:
+                record['peak_memory'] = peak_rss() - rss
+            else:
+                record['peak_memory'] = None
+            self.__add(name, record)
+            for hook in self._hooks:
+                hook('end', name, record)
+
+    def __start_tracing(self):
+        """Starts tracing the memory of a stage.
+
+        The peak of `tracemalloc` is reset for the new stage, so the
+        peak reached so far by the stage running, if any, is kept
+        aside first.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started = True
+        else:
+            started = False
+            if self._traced:
+                outer = self._traced[-1]
+                outer[1] = max(outer[1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        self._traced.append([current, current, started])
+
+    def __stop_tracing(self):
+        """Stops tracing the memory of a stage.
+
+        The peak of the stage is passed on to the stage running it, if
+        any.
+
+        :return: Peak memory of the stage over its memory at the start
+        :rtype: int
+        """
+        start, peak, started = self._traced.pop()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self._traced:
+            self._traced[-1][1] = max(self._traced[-1][1], peak)
+        if started:
+            tracemalloc.stop()
+        return peak - start
+
+    def __add(self, name, record):
+        total = self._records.setdefault(name, {
+            'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'items': 0,
+            'peak_memory': None})
+        total['calls'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['items'] += record['items'] or 0
+        if record['peak_memory'] is not None:
+            total['peak_memory'] = max(total['peak_memory'] or 0,
+                                       record['peak_memory'])
+
+    def to_json(self):
+        """Returns the records of all the stages as JSON."""
+        return json.dumps(self._records, indent=2)
+
+    # Properties
+    records = property(__get_records)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoStats({})".format(', '.join(
+            '{}: {:.3f} s'.format(name, record['wall'])
+            for name, record in self._records.items()))
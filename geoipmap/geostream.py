@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Ingestion of IPs from growing logs, with incremental map updates"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+from geoipmap.georaster import GeoRaster
+from geoipmap.ipparse import parse_ips
+import queue
+import re
+import threading
+import time
+
+
+# IPv4 addresses within any text, such as the lines of an access log
+_IPV4 = re.compile(r'(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?!\.?\d)')
+
+
+def extract_ips(lines):
+    """Finds the IP addresses within some lines of text.
+
+    :param lines: Lines of text, such as the ones of an access log
+    :type lines: iterable
+    :return: IP addresses as integers, in order of appearance
+    :rtype: numpy.ndarray
+    """
+    return parse_ips(ip for line in lines for ip in _IPV4.findall(line))
+
+
+def _read_lines(f, lines, follow, interval):
+    """Puts the lines of a file into a queue, and then `None` (in a
+    thread, as reading may block).
+
+    :see: read_chunks
+    """
+    partial = ''
+    while True:
+        line = f.readline()
+        if line:
+            line = partial + line
+            partial = ''
+            if follow and not line.endswith('\n'):
+                partial = line
+                continue
+            lines.put(line)
+        elif follow:
+            time.sleep(interval)
+        else:
+            break
+    lines.put(None)
+
+
+def read_chunks(f, chunk_size=1000, follow=False, interval=1.0):
+    """Reads the lines of a file in chunks, like 'tail -f'.
+
+    A chunk is given when it is full, or when no new line arrives
+    within `interval` seconds, so a slow stream (such as a pipe on the
+    standard input) is not held until a chunk is full.  The file is
+    read by another thread, which may block waiting for lines.
+
+    When following the file, it waits for new lines when reaching its
+    end, and an incomplete last line is held until it is complete.
+
+    :param f: Open file (or the standard input)
+    :type f: file
+    :param chunk_size: Maximum number of lines per chunk
+    :type chunk_size: int
+    :param follow: When true, wait for new lines instead of ending
+    :type follow: bool
+    :param interval: Seconds to wait for new lines
+    :type interval: float
+    :return: Generator of lists of lines
+    :rtype: generator
+    """
+    lines = queue.Queue()
+    threading.Thread(target=_read_lines, args=(f, lines, follow, interval),
+                     daemon=True).start()
+    chunk = []
+    while True:
+        try:
+            line = lines.get(timeout=interval)
+        except queue.Empty:
+            if chunk:
+                yield chunk
+                chunk = []
+            continue
+        if line is None:
+            if chunk:
+                yield chunk
+            return
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+
+class GeoStream(object):
+    """Feeds a `GeoIpMap` with IPs from a stream of log lines.
+
+    Every chunk of lines is looked up as a whole (every distinct IP of
+    the chunk once), and only the markers of the new pixels are drawn
+    over the image already rendered, which is written again only when
+    it changes.  Every IP is counted, even when it is repeated, as in
+    `GeoIpMap.to_counts`.
+    """
+    def __init__(self, geo, output_file=None, radius=None):
+        """Stream feeding an already loaded `GeoIpMap`:
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param output_file: Path of the image kept updated, if any
+        :type output_file: str
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        """
+        self._geo = geo
+        self._output_file = output_file
+        self._radius = radius
+        self._raster = GeoRaster(geo.img)
+        self._canvas = None
+
+    def __get_canvas(self):
+        """Returns the image with all the pixels found so far."""
+        if self._canvas is None:
+            self._canvas = self._raster.render(self._geo.pixels, self._radius)
+        return self._canvas
+
+    def feed(self, lines):
+        """Looks up the IPs of some lines and updates the image.
+
+        :param lines: Lines of text with IP addresses
+        :type lines: iterable
+        :return: Pixel coordinates (`x`, `y`) not found before
+        :rtype: set
+        """
+        ips = extract_ips(lines)
+        if not len(ips):
+            return set()
+
+        pixels = self._geo.update(ips)
+        if pixels:
+            self._raster.draw(self.canvas, pixels, self._radius)
+            if self._output_file:
+                self._raster.save(self.canvas, self._output_file)
+        return pixels
+
+    def run(self, f, chunk_size=1000, follow=False, interval=1.0,
+            verbose=False):
+        """Feeds all the lines of a file, as they are written.
+
+        :param f: Open file (or the standard input)
+        :type f: file
+        :param verbose: When true, print information on screen
+        :type verbose: bool
+        :see: read_chunks
+        """
+        for chunk in read_chunks(f, chunk_size, follow, interval):
+            pixels = self.feed(chunk)
+            if verbose and pixels:
+                print('{} new locations ({} in total)'
+                      .format(len(pixels), len(self._geo.pixels)))
+
+    # Properties
+    canvas = property(__get_canvas)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoStream({} IPs seen)".format(len(self._geo.ips))
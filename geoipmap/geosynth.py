@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Synthetic databases and IP lists, for testing and benchmarking"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+from geoipmap.ipparse import int_to_ip
+import numpy as np
+
+
+# Lengths of the prefixes of the networks, and how often they appear,
+# roughly like in the GeoLite2 databases
+PREFIXES = (16, 20, 22, 23, 24)
+PREFIX_WEIGHTS = (0.002, 0.048, 0.15, 0.2, 0.6)
+
+# First address of the synthetic networks (1.0.0.0)
+_FIRST = 1 << 24
+
+
+def synth_networks(count, seed=0, gaps=0.2):
+    """Generates non overlapping networks with random coordinates.
+
+    :param count: Number of networks
+    :type count: int
+    :param seed: Seed of the random generator
+    :type seed: int
+    :param gaps: Fraction of the space left without networks
+    :type gaps: float
+    :return: Arrays of the first and last address of every network,
+             its prefix length, latitude and longitude, sorted
+    :rtype: tuple
+    :raises ValueError: If the networks do not fit in IPv4
+    """
+    rng = np.random.default_rng(seed)
+    total = int(count / (1 - gaps)) + 1
+    prefixes = np.sort(rng.choice(PREFIXES, size=total, p=PREFIX_WEIGHTS))
+    sizes = np.left_shift(1, 32 - prefixes).astype(np.int64)
+    # Sorted by decreasing size, every start is aligned to its size
+    starts = _FIRST + np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    if starts[-1] + sizes[-1] > 1 << 32:
+        raise ValueError("{} networks do not fit in IPv4".format(count))
+
+    keep = np.sort(rng.choice(total, size=count, replace=False))
+    starts, sizes, prefixes = starts[keep], sizes[keep], prefixes[keep]
+    order = np.argsort(starts)
+    starts, sizes, prefixes = starts[order], sizes[order], prefixes[order]
+    lats = np.round(rng.uniform(-80, 80, count), 4)
+    lons = np.round(rng.uniform(-180, 180, count), 4)
+    return (starts, starts + sizes - 1, prefixes, lats, lons)
+
+
+def synth_geodb(geodb_file, count, seed=0):
+    """Writes a synthetic CSV database with columns 'network,lat,lon'.
+
+    :param geodb_file: Path of the CSV database
+    :type geodb_file: str
+    :param count: Number of networks
+    :type count: int
+    :param seed: Seed of the random generator
+    :type seed: int
+    :see: synth_networks
+    """
+    starts, _, prefixes, lats, lons = synth_networks(count, seed)
+    with open(geodb_file, 'wt') as f:
+        f.write('network,latitude,longitude\n')
+        chunk = 65536
+        for i in range(0, count, chunk):
+            f.writelines('{}/{},{:.4f},{:.4f}\n'.format(
+                int_to_ip(start), prefix, lat, lon)
+                for start, prefix, lat, lon in zip(
+                    starts[i:i + chunk].tolist(),
+                    prefixes[i:i + chunk].tolist(),
+                    lats[i:i + chunk].tolist(),
+                    lons[i:i + chunk].tolist()))
+
+
+def synth_ips(ips_file, count, networks, seed=0, hits=0.9):
+    """Writes a synthetic list of IPs, one per line.
+
+    :param ips_file: Path of the IP list
+    :type ips_file: str
+    :param count: Number of IPs
+    :type count: int
+    :param networks: Number of networks of the database (and the same
+                     seed), to make IPs within them
+    :type networks: int
+    :param seed: Seed of the random generator used for the database
+    :type seed: int
+    :param hits: Fraction of the IPs within a network
+    :type hits: float
+    """
+    starts, ends, _, _, _ = synth_networks(networks, seed)
+    rng = np.random.default_rng(seed + 1)
+    chosen = rng.integers(0, networks, size=count)
+    ips = starts[chosen] + (rng.random(count) *
+                            (ends[chosen] - starts[chosen] + 1)).astype(
+                                np.int64)
+    misses = rng.random(count) >= hits
+    ips[misses] = rng.integers(0, _FIRST, size=int(misses.sum()))
+    with open(ips_file, 'wt') as f:
+        f.writelines(int_to_ip(ip) + '\n' for ip in ips.tolist())
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Pyramid of z/x/y tiles in Web Mercator for zoomable maps"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+from geoipmap.geoimage import GeoImage
+from geoipmap.geopool import call_shared
+from geoipmap.geopool import can_fork
+from geoipmap.geopool import fork_pool
+from geoipmap.georaster import GeoRaster
+import math
+import numpy as np
+import os
+import shutil
+import string
+
+
+# Latitude where the square of Web Mercator ends
+MAX_LATITUDE = math.degrees(math.atan(math.sinh(math.pi)))
+
+# Locations already drawn, as rows of float32 (latitude, longitude)
+_POINTS_FILE = 'points.npy'
+
+# Directory of the tiles of the map image
+_BASE_DIR = 'base'
+
+# Static viewer of the tiles, written along them
+_VIEWER_FILE = 'index.html'
+_VIEWER = string.Template("""\
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>GeoIPMap</title>
+<style>
+  html, body { margin: 0; height: 100%; overflow: hidden; }
+  body { background: #1d2b3a; font-family: sans-serif; }
+  #map { position: absolute; width: 100%; height: 100%; cursor: grab; }
+  #map img { position: absolute; width: ${tile_size}px;
+             height: ${tile_size}px; user-select: none; }
+  #zoom { position: absolute; top: 10px; left: 10px; }
+  #zoom button { display: block; width: 32px; height: 32px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="zoom"><button id="in">+</button><button id="out">-</button></div>
+<script>
+var MIN_ZOOM = ${min_zoom}, MAX_ZOOM = ${max_zoom};
+var TILE = ${tile_size}, LAYERS = ${layers};
+var map = document.getElementById('map');
+var zoom = MIN_ZOOM;
+// Center of the view, in pixels of the whole world at the zoom level
+var cx = (TILE << zoom) / 2, cy = cx;
+var drag = null;
+
+function draw() {
+  var n = 1 << zoom, w = map.clientWidth, h = map.clientHeight;
+  var left = Math.round(cx - w / 2), top = Math.round(cy - h / 2);
+  var x0 = Math.max(0, Math.floor(left / TILE));
+  var y0 = Math.max(0, Math.floor(top / TILE));
+  var x1 = Math.min(n, Math.ceil((left + w) / TILE));
+  var y1 = Math.min(n, Math.ceil((top + h) / TILE));
+  map.innerHTML = '';
+  map.style.transform = '';
+  LAYERS.forEach(function (layer) {
+    for (var x = x0; x < x1; x++) {
+      for (var y = y0; y < y1; y++) {
+        var img = document.createElement('img');
+        img.style.left = (x * TILE - left) + 'px';
+        img.style.top = (y * TILE - top) + 'px';
+        img.onerror = function () { this.remove(); };
+        img.draggable = false;
+        img.src = layer + zoom + '/' + x + '/' + y + '.png';
+        map.appendChild(img);
+      }
+    }
+  });
+}
+
+function zoomAt(level, px, py) {
+  level = Math.max(MIN_ZOOM, Math.min(MAX_ZOOM, level));
+  var scale = Math.pow(2, level - zoom);
+  var w = map.clientWidth, h = map.clientHeight;
+  cx = (cx - w / 2 + px) * scale - px + w / 2;
+  cy = (cy - h / 2 + py) * scale - py + h / 2;
+  zoom = level;
+  draw();
+}
+
+map.onmousedown = function (e) {
+  drag = {x: e.clientX, y: e.clientY, cx: cx, cy: cy};
+};
+window.onmousemove = function (e) {
+  if (drag) {
+    cx = drag.cx - (e.clientX - drag.x);
+    cy = drag.cy - (e.clientY - drag.y);
+    map.style.transform = 'translate(' + (e.clientX - drag.x) + 'px,' +
+                          (e.clientY - drag.y) + 'px)';
+  }
+};
+window.onmouseup = function () {
+  if (drag) {
+    drag = null;
+    draw();
+  }
+};
+map.onwheel = function (e) {
+  e.preventDefault();
+  zoomAt(zoom + (e.deltaY < 0 ? 1 : -1), e.clientX, e.clientY);
+};
+document.getElementById('in').onclick = function () {
+  zoomAt(zoom + 1, map.clientWidth / 2, map.clientHeight / 2);
+};
+document.getElementById('out').onclick = function () {
+  zoomAt(zoom - 1, map.clientWidth / 2, map.clientHeight / 2);
+};
+window.onresize = draw;
+draw();
+</script>
+</body>
+</html>
+""")
+
+def world_image(img, zoom, tile_size=256):
+    """Returns the image of the whole world at a zoom level.
+
+    Web Mercator is the projection of `GeoImage` over a square image
+    from 180 degrees west to 180 east, ending at `MAX_LATITUDE`.
+
+    :param img: Image object the tiles are made for
+    :type img: GeoImage
+    :param zoom: Zoom level, with 2**zoom tiles per side
+    :type zoom: int
+    :param tile_size: Side of the tiles in pixels
+    :type tile_size: int
+    :return: Image of the world at that zoom level
+    :rtype: GeoImage
+    """
+    size = tile_size << zoom
+    return GeoImage(img.filepath, size, size, -180, 180, -MAX_LATITUDE)
+
+
+class GeoTiles(object):
+    """Writes the locations of IPs as a pyramid of tiles for zooming.
+
+    Every zoom level `z` splits the world in 2**z × 2**z tiles, written
+    as '<z>/<x>/<y>.png' with the markers over a transparent background,
+    so a viewer only loads the tiles in sight.  Only the tiles with any
+    location are written.  The locations drawn are kept along the
+    tiles, so new IPs only render again the tiles of their new
+    locations.  The tiles are rendered in parallel by a pool of forked
+    processes, and a static viewer ('index.html') is written with them.
+
+    The map image may be cut in tiles too, beneath the locations, as
+    'base/<z>/<x>/<y>.png'; these are written only once.
+    """
+    def __init__(self, geo, output_dir, max_zoom=6, min_zoom=0,
+                 tile_size=256, radius=3, num_workers=4):
+        """Pyramid of tiles for an already loaded `GeoIpMap`:
+
+        :param geo: Object with the database loaded
+        :type geo: GeoIpMap
+        :param output_dir: Directory of the tiles
+        :type output_dir: str
+        :param max_zoom: Deepest zoom level
+        :type max_zoom: int
+        :param min_zoom: Shallowest zoom level
+        :type min_zoom: int
+        :param tile_size: Side of the tiles in pixels
+        :type tile_size: int
+        :param radius: radius in pixels of the circles
+        :type radius: float
+        :param num_workers: Number of processes rendering tiles
+        :type num_workers: int
+        :raises ValueError: If the database is not loaded (merge method)
+        """
+        if geo.geodb is None:
+            raise ValueError("The tiles need the database loaded; "
+                             "they cannot be used with method 'merge'")
+        self._geo = geo
+        self._output_dir = output_dir
+        self._zooms = range(min_zoom, max_zoom + 1)
+        self._tile_size = tile_size
+        self._radius = radius
+        self._num_workers = num_workers
+        self._raster = GeoRaster(geo.img)
+
+    def __get_output_dir(self):
+        return self._output_dir
+
+    def __get_zooms(self):
+        return self._zooms
+
+    def __get_points(self):
+        """Returns the locations drawn so far, as rows `(lat, lon)`."""
+        points_file = os.path.join(self._output_dir, _POINTS_FILE)
+        if not os.path.exists(points_file):
+            return np.zeros((0, 2), dtype=np.float32)
+        return np.load(points_file)
+
+    def __tile_path(self, zoom, x, y, base=False):
+        """Returns the path of a tile, creating its directory."""
+        tile_dir = os.path.join(self._output_dir, *(
+            [_BASE_DIR] if base else []) + [str(zoom), str(x)])
+        os.makedirs(tile_dir, exist_ok=True)
+        return os.path.join(tile_dir, '{}.png'.format(y))
+
+    def locations(self, ips, ips6=None):
+        """Returns the distinct locations of some IPs.
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :param ips6: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips6: numpy.ndarray
+        :return: Latitude and longitude of every location, as rows
+        :rtype: numpy.ndarray
+        """
+        points = [np.zeros((0, 2), dtype=np.float32)]
+        for index, positions in zip((self._geo.geodb, self._geo.geodb6),
+                                    self._geo.find(ips, ips6)):
+            positions = np.unique(positions[positions >= 0])
+            if len(positions):
+                points.append(np.column_stack([index.lats[positions],
+                                               index.lons[positions]]))
+        return np.unique(np.concatenate(points), axis=0)
+
+    def __markers(self, zoom, points):
+        """Finds the tiles of a zoom level where some points are drawn.
+
+        The marker of a point near the edge of a tile is drawn in its
+        neighbours too.
+
+        :return: Tiles `x` and `y` of every marker, sorted by tile, and
+                 the pixel coordinates `x` and `y` of the markers within
+                 the whole world
+        :rtype: tuple
+        """
+        world = world_image(self._geo.img, zoom, self._tile_size)
+        xs, ys = world.geo_to_pixels(points[:, 0], points[:, 1])
+        last = (1 << zoom) - 1
+        tiles = []
+        for dx in (-self._radius, self._radius):
+            for dy in (-self._radius, self._radius):
+                tiles.append(np.column_stack([
+                    np.clip((xs + dx) // self._tile_size, 0, last),
+                    np.clip((ys + dy) // self._tile_size, 0, last),
+                    np.arange(len(points))]))
+        markers = np.unique(np.concatenate(tiles).astype(np.int64), axis=0)
+        tx, ty, rows = markers.T
+        return (tx, ty, xs[rows], ys[rows])
+
+    def __jobs(self, zoom, points, dirty):
+        """Returns the jobs rendering the tiles touched by some points.
+
+        :param points: All the locations, as rows `(lat, lon)`
+        :type points: numpy.ndarray
+        :param dirty: New locations, as rows `(lat, lon)`
+        :type dirty: numpy.ndarray
+        :return: Zoom level, tile `x` and `y`, and pixel coordinates of
+                 the markers within the tile, for every tile
+        :rtype: generator
+        """
+        side = 1 << zoom
+        tx, ty = self.__markers(zoom, dirty)[:2]
+        dirty_tiles = np.unique(tx * side + ty)
+        tx, ty, xs, ys = self.__markers(zoom, points)
+        keep = np.isin(tx * side + ty, dirty_tiles)
+        tx, ty, xs, ys = tx[keep], ty[keep], xs[keep], ys[keep]
+        bounds = np.flatnonzero(np.diff(tx * side + ty)) + 1
+        for first, end in zip(np.concatenate([[0], bounds]),
+                              np.concatenate([bounds, [len(tx)]])):
+            x, y = int(tx[first]), int(ty[first])
+            yield (zoom, x, y, xs[first:end] - x * self._tile_size,
+                   ys[first:end] - y * self._tile_size)
+
+    def __render_all(self, method, jobs):
+        """Runs some jobs in the pool, or here if it is not worth it.
+
+        :param method: Name of the method rendering every job
+        :type method: str
+        :return: Results of the jobs, in order
+        :rtype: list
+        """
+        jobs = list(jobs)
+        if self._num_workers <= 1 or len(jobs) <= 1 or not can_fork():
+            return [getattr(self, method)(*job) for job in jobs]
+
+        with fork_pool(self, self._num_workers) as pool:
+            return pool.map(call_shared, [(method, job) for job in jobs],
+                            chunksize=max(1, len(jobs) //
+                                          (4 * self._num_workers)))
+
+    def render_tile(self, zoom, x, y, xs, ys):
+        """Renders and writes a tile of locations.
+
+        :param zoom: Zoom level
+        :type zoom: int
+        :param x: Column of the tile
+        :type x: int
+        :param y: Row of the tile
+        :type y: int
+        :param xs: Horizontal pixel coordinates within the tile
+        :type xs: numpy.ndarray
+        :param ys: Vertical pixel coordinates within the tile
+        :type ys: numpy.ndarray
+        :return: Path of the tile
+        :rtype: str
+        """
+        buf = np.zeros((self._tile_size, self._tile_size, 4), dtype=np.uint8)
+        GeoRaster.stamp(buf, xs, ys, self._radius, (0, 0, 0))
+        GeoRaster.stamp(buf, xs, ys, max(self._radius - 1, 0.5), (255, 0, 0))
+        path = self.__tile_path(zoom, x, y)
+        GeoRaster.save(buf, path)
+        return path
+
+    def render_base_tile(self, zoom, x, y):
+        """Renders and writes a tile of the map image.
+
+        Every pixel of the tile takes the pixel of the map image at the
+        same location, if any.
+
+        :param zoom: Zoom level
+        :type zoom: int
+        :param x: Column of the tile
+        :type x: int
+        :param y: Row of the tile
+        :type y: int
+        :return: Path of the tile, or `None` if the map image does not
+                 reach it
+        :rtype: str
+        """
+        size = self._tile_size << zoom
+        gxs = (x * self._tile_size + np.arange(self._tile_size) + 0.5) / size
+        gys = (y * self._tile_size + np.arange(self._tile_size) + 0.5) / size
+        lons = gxs * 360 - 180
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * gys))))
+        base = self._raster.base
+        cols = np.floor(self._geo.img.geo_to_pixels(
+            np.zeros_like(lons), lons)[0]).astype(np.int64)
+        rows = np.floor(self._geo.img.geo_to_pixels(
+            lats, np.zeros_like(lats))[1]).astype(np.int64)
+        in_cols = (cols >= 0) & (cols < base.shape[1])
+        in_rows = (rows >= 0) & (rows < base.shape[0])
+        if not in_cols.any() or not in_rows.any():
+            return None
+
+        buf = np.zeros((self._tile_size, self._tile_size, 4), dtype=np.uint8)
+        buf[np.ix_(in_rows, in_cols)] = \
+            base[np.ix_(rows[in_rows], cols[in_cols])]
+        path = self.__tile_path(zoom, x, y, base=True)
+        GeoRaster.save(buf, path)
+        return path
+
+    def render_base(self):
+        """Writes the tiles of the map image not written yet.
+
+        :return: Paths of the tiles written
+        :rtype: list
+        """
+        jobs = [(zoom, x, y) for zoom in self._zooms
+                for x in range(1 << zoom) for y in range(1 << zoom)
+                if not os.path.exists(os.path.join(
+                    self._output_dir, _BASE_DIR, str(zoom), str(x),
+                    '{}.png'.format(y)))]
+        with self._geo.stats.stage('base_tiles', len(jobs)):
+            # Decoded before forking, so the workers share it
+            self._raster.base
+            paths = self.__render_all('render_base_tile', jobs)
+        self.write_viewer()
+        return [path for path in paths if path is not None]
+
+    def update(self, ips, ips6=None):
+        """Draws the locations of some IPs, besides the ones drawn.
+
+        Only the tiles where the new locations are drawn are rendered
+        again (with all the locations within them).
+
+        :param ips: IP addresses as integers
+        :type ips: sequence
+        :param ips6: IPv6 addresses as pairs (`hi`, `lo`) of integers
+        :type ips6: numpy.ndarray
+        :return: Paths of the tiles written
+        :rtype: list
+        """
+        drawn = self.__get_points()
+        points = self.locations(ips, ips6)
+        # Compared as the 8 bytes of every row
+        new = points[~np.isin(points.view(np.uint64).ravel(),
+                              drawn.view(np.uint64).ravel())]
+        if not len(new):
+            return []
+
+        points = np.concatenate([drawn, new])
+        jobs = [job for zoom in self._zooms
+                for job in self.__jobs(zoom, points, new)]
+        with self._geo.stats.stage('tiles', len(jobs)):
+            paths = self.__render_all('render_tile', jobs)
+        # Saved after the tiles, so they are drawn again if any fails
+        np.save(os.path.join(self._output_dir, _POINTS_FILE), points)
+        self.write_viewer()
+        return paths
+
+    def clear(self):
+        """Removes the tiles of locations and the locations drawn.
+
+        The tiles of the map image, if any, are kept.
+        """
+        if not os.path.isdir(self._output_dir):
+            return
+        for name in os.listdir(self._output_dir):
+            if name.isdigit():
+                shutil.rmtree(os.path.join(self._output_dir, name))
+        points_file = os.path.join(self._output_dir, _POINTS_FILE)
+        if os.path.exists(points_file):
+            os.remove(points_file)
+
+    def write_viewer(self):
+        """Writes the static viewer of the tiles ('index.html').
+
+        :return: Path of the viewer
+        :rtype: str
+        """
+        os.makedirs(self._output_dir, exist_ok=True)
+        layers = ["''"]
+        if os.path.isdir(os.path.join(self._output_dir, _BASE_DIR)):
+            layers.insert(0, "'{}/'".format(_BASE_DIR))
+        path = os.path.join(self._output_dir, _VIEWER_FILE)
+        with open(path, 'wt') as f:
+            f.write(_VIEWER.substitute(
+                min_zoom=self._zooms.start, max_zoom=self._zooms.stop - 1,
+                tile_size=self._tile_size,
+                layers='[{}]'.format(', '.join(layers))))
+        return path
+
+    # Properties
+    output_dir = property(__get_output_dir)
+    zooms = property(__get_zooms)
+    points = property(__get_points)
+
+    # Class printing
+    def __repr__(self):
+        return "GeoTiles('{}', zoom {}-{})".format(
+            self._output_dir, self._zooms.start, self._zooms.stop - 1)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# vim: set ft=python fenc=utf8 fo=tcqrj1n:
+
+# GEOIPMAP :: World map plotting of locations associated to IPs
+# Copyright (C) 2019, J. A. Corbal <jacorbal@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Parsing of IP addresses and networks into integers"""
+
+__author__ = "J. A. Corbal"
+__copyright__ = "Copyright (C) 2019, J. A. Corbal"
+__license__ = "BSD 2-Clause"
+__version__ = "1.2.0"
+__mantainer__ = "J. A. Corbal"
+__email__ = "jacorbal@gmail.com"
+__status__ = "Development"
+
+
+import numpy as np
+import socket
+
+try:
+    import netaddr
+except ImportError:
+    netaddr = None
+
+
+# IPv6 addresses as pairs of 64-bit integers (high and low halves).  The
+# fields are big-endian, so the 16 bytes of an address compare as the
+# address itself
+IPV6_DTYPE = np.dtype([('hi', '>u8'), ('lo', '>u8')])
+
+# Prefix of the IPv4 addresses mapped into IPv6 ('::ffff:a.b.c.d')
+_IPV4_MAPPED = bytes(10) + b'\xff\xff'
+
+
+def ip_to_int(ip):
+    """Converts an IP address in dotted-quad notation into an integer.
+
+    When the address is not in the strict dotted-quad notation and
+    `netaddr` is installed, it is used as a fallback.
+
+    :param ip: IP address
+    :type ip: str
+    :return: IP address as an integer, or `None` if it is not valid
+    :rtype: int
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except (OSError, ValueError):
+        if netaddr is not None and netaddr.valid_ipv4(ip):
+            return int(netaddr.IPAddress(ip))
+        return None
+
+
+def int_to_ip(value):
+    """Converts an integer into an IP address in dotted-quad notation.
+
+    :param value: IP address as an integer
+    :type value: int
+    :return: IP address
+    :rtype: str
+    """
+    return socket.inet_ntop(socket.AF_INET, value.to_bytes(4, 'big'))
+
+
+def ip6_to_int(ip):
+    """Converts an IPv6 address into an integer.
+
+    :param ip: IPv6 address
+    :type ip: str
+    :return: IP address as an integer, or `None` if it is not valid
+    :rtype: int
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def int_to_ip6(value):
+    """Converts an integer into an IPv6 address.
+
+    :param value: IP address as an integer
+    :type value: int
+    :return: IPv6 address
+    :rtype: str
+    """
+    return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+
+def ints_to_ipv6(values):
+    """Converts IPv6 addresses as integers into pairs of halves.
+
+    :param values: IP addresses as integers
+    :type values: sequence
+    :return: IP addresses as pairs (`hi`, `lo`)
+    :rtype: numpy.ndarray
+    """
+    packed = b''.join(int(value).to_bytes(16, 'big') for value in values)
+    return np.frombuffer(packed, dtype=IPV6_DTYPE)
+
+
+def ipv6_to_ips(values):
+    """Converts IPv6 addresses as pairs of halves into strings.
+
+    :param values: IP addresses as pairs (`hi`, `lo`)
+    :type values: numpy.ndarray
+    :return: IPv6 addresses
+    :rtype: generator
+    """
+    packed = np.ascontiguousarray(values, dtype=IPV6_DTYPE).tobytes()
+    return (socket.inet_ntop(socket.AF_INET6, packed[i:i + 16])
+            for i in range(0, len(packed), 16))
+
+
+def split_ips(lines):
+    """Converts the valid IP addresses of some lines into integers,
+    apart for every version.
+
+    Every line is validated and converted once; blank lines and lines
+    with anything else than an IP address are skipped.  The IPv4
+    addresses mapped into IPv6 ('::ffff:a.b.c.d') are taken as IPv4.
+
+    :param lines: Lines with an IP address each
+    :type lines: iterable
+    :return: IPv4 addresses as integers, and IPv6 addresses as pairs
+             (`hi`, `lo`) of integers (see `IPV6_DTYPE`)
+    :rtype: pair
+    """
+    packed, packed6 = bytearray(), bytearray()
+    for line in lines:
+        ip = line.strip()
+        if not ip:
+            continue
+        try:
+            packed += socket.inet_pton(socket.AF_INET, ip)
+            continue
+        except (OSError, ValueError):
+            pass
+        if ':' in ip:
+            try:
+                addr = socket.inet_pton(socket.AF_INET6, ip)
+            except (OSError, ValueError):
+                continue
+            if addr.startswith(_IPV4_MAPPED):
+                packed += addr[12:]
+            else:
+                packed6 += addr
+            continue
+        value = ip_to_int(ip)
+        if value is not None:
+            packed += value.to_bytes(4, 'big')
+    return (np.frombuffer(bytes(packed), dtype='>u4').astype(np.uint32),
+            np.frombuffer(bytes(packed6), dtype=IPV6_DTYPE))
+
+
+def parse_ips(lines):
+    """Converts the valid IPv4 addresses of some lines into integers.
+
+    :param lines: Lines with an IP address each
+    :type lines: iterable
+    :return: IP addresses as integers
+    :rtype: numpy.ndarray
+    :see: split_ips
+    """
+    return split_ips(lines)[0]
+
+
+def cidr_to_range(cidr):
+    """Converts a network in CIDR notation into its integer bounds.
+
+    When the network is not in the notation 'a.b.c.d/n' (e.g., with a
+    netmask instead of a prefix length) and `netaddr` is installed, it
+    is used as a fallback.
+
+    :param cidr: Network, such as '73.185.104.0/23'
+    :type cidr: str
+    :return: First and last addresses of the network
+    :rtype: pair
+    :raises ValueError: If the network is not valid
+    """
+    addr, _, prefix = cidr.partition('/')
+    try:
+        start = int.from_bytes(socket.inet_pton(socket.AF_INET, addr), 'big')
+        prefix = int(prefix) if prefix else 32
+        if not 0 <= prefix <= 32:
+            raise ValueError(prefix)
+    except (OSError, ValueError):
+        if netaddr is None:
+            raise ValueError("Invalid network: '{}'".format(cidr))
+        try:
+            network = netaddr.IPNetwork(cidr)
+        except netaddr.AddrFormatError:
+            raise ValueError("Invalid network: '{}'".format(cidr))
+        if network.version != 4:
+            raise ValueError("Invalid network: '{}'".format(cidr))
+        return (network.first, network.last)
+
+    size = 1 << (32 - prefix)
+    start &= ~(size - 1)
+    return (start, start + size - 1)
+
+
+def cidr6_to_range(cidr):
+    """Converts an IPv6 network in CIDR notation into its integer bounds.
+
+    :param cidr: Network, such as '2001:db8::/32'
+    :type cidr: str
+    :return: First and last addresses of the network
+    :rtype: pair
+    :raises ValueError: If the network is not valid
+    """
+    addr, _, prefix = cidr.partition('/')
+    start = ip6_to_int(addr)
+    try:
+        prefix = int(prefix) if prefix else 128
+    except ValueError:
+        start = None
+    if start is None or not 0 <= prefix <= 128:
+        raise ValueError("Invalid network: '{}'".format(cidr))
+
+    size = 1 << (128 - prefix)
+    start &= ~(size - 1)
+    return (start, start + size - 1)
@@ -29,8 +29,23 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import atexit
+from geoipmap import GeoAnimation
+from geoipmap import GeoBatch
+from geoipmap import GeoBulk
 from geoipmap import GeoImage
+from geoipmap import GeoIndex
+from geoipmap import GeoIndex6
 from geoipmap import GeoIpMap
+from geoipmap import GeoPatch
+from geoipmap import GeoServer
+from geoipmap import GeoStats
+from geoipmap import GeoStream
+from geoipmap import GeoTiles
+from geoipmap import compiled_file
+from geoipmap import read_events
+from geoipmap import read_groups
+import os
 import sys
 
 
@@ -41,7 +56,11 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--iplist', default='data/ips.lst',
                         help="File of IPs to plot, one per line")
     parser.add_argument('-g', '--geodb', default='data/geoip_ipv4.csv',
-                        help="CSV document with columns: 'network,lat,lon'")
+                        help="CSV document with columns: 'network,lat,lon' \
+                              (it may be a GeoLite2 '.zip' or '.csv.gz')")
+    parser.add_argument('-6', '--geodb6',
+                        help="Same as '-g' for the IPv6 networks (IPv6 \
+                              addresses are skipped without it)")
     parser.add_argument('-f', '--imagefile', default='data/worldmap_raw.jpg',
                         help="Path for the template image to plot over")
     parser.add_argument('-W', '--width', default='2058',
@@ -61,42 +80,351 @@ if __name__ == '__main__':
                         help="Sets the method to multiprocessing (use it with \
                               the '-w' option")
     parser.add_argument('-n', '--nsplits', default='10',
-                        help="Parts the file 'geodb' is divided (threading)")
+                        help="Parts the IP list is divided (threading)")
     parser.add_argument('-w', '--nworkers', default='4',
                         help="Number of workers (multiprocessing)")
     parser.add_argument('-R', '--raw', action='store_true',
                         help="Do not use threading nor multiprocessing")
+    parser.add_argument('-M', '--merge', action='store_true',
+                        help="Read the 'geodb' row by row instead of \
+                              loading it (it must be sorted)")
+    parser.add_argument('-o', '--output',
+                        help="Write the map to this image file (PNG, JPEG) \
+                              instead of showing it")
+    parser.add_argument('-e', '--export',
+                        help="Write the CSV 'ip,lat,lon,x,y' of the IPs \
+                              found to this file ('-' for the standard \
+                              output) instead of plotting them")
+    parser.add_argument('-T', '--tail', action='store_true',
+                        help="Follow the IP list as a growing log ('-' \
+                              for the standard input) and keep the image \
+                              of the '-o' option updated")
+    parser.add_argument('-D', '--density', type=int, metavar='CELL_SIZE',
+                        help="Write a heatmap of the number of IPs per \
+                              cell of this size in pixels (use it with \
+                              the '-o' option)")
+    parser.add_argument('-C', '--cache',
+                        help="File to keep the locations of the IPs \
+                              between runs")
+    parser.add_argument('-P', '--cache-prefix', type=int, default=32,
+                        help="Bits of the IPs sharing an entry of the \
+                              cache, e.g., 24 for blocks of 256 IPs (the \
+                              location of the first one is used)")
+    parser.add_argument('-S', '--stats', action='store_true',
+                        help="Write the time, memory and items of every \
+                              stage as JSON to the standard error")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="With '-S', trace the peak memory allocated \
+                              by every stage (precise, but slower)")
+    parser.add_argument('-L', '--memory-limit', type=int, metavar='MB',
+                        help="Read the IP list in chunks, using about this \
+                              memory for the IPs (use it with the '-o' or \
+                              the '-e' option)")
+    parser.add_argument('-c', '--compiled', action='store_true',
+                        help="Use the compiled 'geodb' when it is newer \
+                              than the CSV (see the 'compile' command)")
+
+    subparsers = parser.add_subparsers(dest='command')
+    compile_parser = subparsers.add_parser(
+        'compile', help="Compile the CSV 'geodb' into a binary file")
+    compile_parser.add_argument('-g', '--geodb', default='data/geoip_ipv4.csv',
+                                help="CSV document with columns: \
+                                      'network,lat,lon'")
+    compile_parser.add_argument('-o', '--output',
+                                help="Path of the compiled file (by default, \
+                                      the CSV path with extension '.idx')")
+    compile_parser.add_argument('-6', '--ipv6', action='store_true',
+                                help="The networks of the CSV are IPv6")
+    compile_parser.add_argument('-k', '--coalesce', action='store_true',
+                                help="Merge the adjacent networks with the \
+                                      same coordinates")
+    compile_parser.add_argument('-p', '--pixels', action='store_true',
+                                help="Merge the adjacent networks falling \
+                                      in the same pixel of the image (the \
+                                      file is only valid for that image)")
+    diff_parser = subparsers.add_parser(
+        'diff', help="Write the patch from a 'geodb' to a newer version")
+    diff_parser.add_argument('-g', '--geodb', default='data/geoip_ipv4.csv',
+                             help="Current database (CSV or compiled)")
+    diff_parser.add_argument('-N', '--new', required=True,
+                             help="New version of the database (CSV or \
+                                   compiled)")
+    diff_parser.add_argument('-o', '--output', required=True,
+                             help="Path of the patch")
+    diff_parser.add_argument('-6', '--ipv6', action='store_true',
+                             help="The networks of the databases are IPv6")
+    patch_parser = subparsers.add_parser(
+        'patch', help="Apply a patch to a compiled 'geodb'")
+    patch_parser.add_argument('-g', '--geodb', default='data/geoip_ipv4.idx',
+                              help="Current database (CSV or compiled)")
+    patch_parser.add_argument('-P', '--patch', required=True,
+                              help="Patch written by the 'diff' command")
+    patch_parser.add_argument('-o', '--output',
+                              help="Path of the new compiled database (by \
+                                    default, the current one)")
+    batch_parser = subparsers.add_parser(
+        'batch', help="Render a map per IP list, loading everything once")
+    batch_parser.add_argument('lists', nargs='*',
+                              help="Files of IPs, one map per file")
+    batch_parser.add_argument('-G', '--groups',
+                              help="CSV document with columns: 'group,ip', \
+                                    one map per group")
+    batch_parser.add_argument('-d', '--directory', default='maps',
+                              help="Directory of the maps")
+    batch_parser.add_argument('-x', '--format', default='png',
+                              help="Format of the maps (PNG, JPEG)")
+    animate_parser = subparsers.add_parser(
+        'animate', help="Render a frame per interval of timestamped IPs")
+    animate_parser.add_argument('events',
+                                help="CSV document with columns: \
+                                      'timestamp,ip' ('-' for stdin)")
+    animate_parser.add_argument('-o', '--output', required=True,
+                                help="Animation ('.gif', '.mp4'), or else \
+                                      directory of PNG frames")
+    animate_parser.add_argument('-I', '--interval', type=float,
+                                default=3600,
+                                help="Seconds of time per frame")
+    animate_parser.add_argument('-F', '--fps', type=float, default=4,
+                                help="Frames per second of the animation")
+    tiles_parser = subparsers.add_parser(
+        'tiles', help="Write the IP list as z/x/y tiles, with a viewer")
+    tiles_parser.add_argument('-d', '--directory', default='tiles',
+                              help="Directory of the tiles (the IPs are \
+                                    added to the ones already there)")
+    tiles_parser.add_argument('-z', '--max-zoom', type=int, default=6,
+                              help="Deepest zoom level")
+    tiles_parser.add_argument('-Z', '--min-zoom', type=int, default=0,
+                              help="Shallowest zoom level")
+    tiles_parser.add_argument('-B', '--base', action='store_true',
+                              help="Cut the map image in tiles too")
+    tiles_parser.add_argument('-X', '--clear', action='store_true',
+                              help="Remove the IPs already there first")
+    serve_parser = subparsers.add_parser(
+        'serve', help="Keep the 'geodb' loaded and answer lookups")
+    serve_parser.add_argument('-s', '--socket',
+                              help="Path of the Unix socket to listen on")
+    serve_parser.add_argument('-p', '--port', type=int, default=8642,
+                              help="TCP port to listen on (localhost), if \
+                                    no Unix socket is given")
     args = parser.parse_args()
+    stats = GeoStats(trace_memory=args.trace_memory)
+
+    # Image object instantiation
+    img = GeoImage(args.imagefile,
+                   width=int(args.width),
+                   height=int(args.height),
+                   w_deg=float(args.left),
+                   e_deg=float(args.right),
+                   s_deg=float(args.bottom))
+
+    if args.command == 'compile':
+        output = args.output or compiled_file(args.geodb, args.ipv6)
+        print('Compiling', args.geodb, 'into', output)
+        index_class = GeoIndex6 if args.ipv6 else GeoIndex
+        index = index_class.from_csv(args.geodb)
+        if args.coalesce or args.pixels:
+            count = len(index)
+            index = index.coalesce(img if args.pixels else None)
+            print('Coalesced {} networks into {} ranges'
+                  .format(count, len(index)))
+        index.save(output)
+        exit(0)
 
-    if (args.threading and args.multiprocessing) or \
-       (args.threading and args.raw) or (args.multiprocessing and args.raw):
+    if args.command == 'diff':
+        index_class = GeoIndex6 if args.ipv6 else GeoIndex
+        patch = GeoPatch.diff(index_class.open(args.geodb),
+                              index_class.open(args.new))
+        print('Writing', patch, 'into', args.output)
+        patch.save(args.output)
+        exit(0)
+
+    if args.command == 'patch':
+        patch = GeoPatch.load(args.patch)
+        output = args.output or compiled_file(
+            args.geodb, isinstance(patch.added, GeoIndex6))
+        print('Applying', patch, 'to', args.geodb, 'into', output)
+        patch.apply(type(patch.added).open(args.geodb)).save(output)
+        exit(0)
+
+    def newest(geodb_file, ipv6=False):
+        """Returns the compiled database when it is newer than the CSV."""
+        compiled = compiled_file(geodb_file, ipv6)
+        if os.path.exists(compiled) and \
+           os.path.getmtime(compiled) >= os.path.getmtime(geodb_file):
+            return compiled
+        return geodb_file
+
+    geodb, geodb6 = args.geodb, args.geodb6
+    if args.compiled:
+        geodb = newest(geodb)
+        geodb6 = newest(geodb6, True) if geodb6 else None
+
+    if [args.threading, args.multiprocessing,
+            args.raw, args.merge].count(True) > 1:
         print("Error: conflicting options.  Use '-h' or '--help' for help.",
               file=sys.stderr)
         exit(1)
 
+    if args.merge and (args.density or args.memory_limit or
+                       args.command == 'tiles'):
+        print("Error: conflicting options: '-M' does not load the database, "
+              "which '-D', '-L' and 'tiles' need.  Use '-h' or '--help' for "
+              "help.", file=sys.stderr)
+        exit(1)
+
+    if not 0 <= args.cache_prefix <= 32:
+        print("Error: '-P' must be between 0 and 32 bits.  Use '-h' or "
+              "'--help' for help.", file=sys.stderr)
+        exit(1)
+
+    if (args.density or args.tail) and not args.output:
+        print("Error: '-D' and '-T' require '-o'.  Use '-h' or '--help' "
+              "for help.", file=sys.stderr)
+        exit(1)
+
     if args.raw:
         arg_method = 'raw'
+    elif args.merge:
+        arg_method = 'merge'
     else:
         arg_method = 'threading' if args.threading else 'multiprocessing'
 
     arg_nsplits = int(args.nsplits) if not args.raw else 0
     arg_nworkers = int(args.nworkers) if not args.raw else 0
 
-    # Image object instantiation
-    img = GeoImage(args.imagefile,
-                   width=int(args.width),
-                   height=int(args.height),
-                   w_deg=float(args.left),
-                   e_deg=float(args.right),
-                   s_deg=float(args.bottom))
+    if args.command == 'serve':
+        print('Unpacking', geodb)
+        geo = GeoIpMap(None, geodb, img, method='raw', cache_file=args.cache,
+                       cache_prefix=args.cache_prefix,
+                       geodb6_file=geodb6, stats=stats)
+        print('Serving on', args.socket or 'port {}'.format(args.port))
+        GeoServer(geo).serve(path=args.socket, port=args.port)
+        exit(0)
+
+    if args.command == 'batch':
+        print('Unpacking', geodb)
+        geo = GeoIpMap(None, geodb, img, method='raw', cache_file=args.cache,
+                       cache_prefix=args.cache_prefix,
+                       geodb6_file=geodb6, stats=stats)
+        if args.stats:
+            atexit.register(lambda: print(geo.stats.to_json(),
+                                          file=sys.stderr))
+        batch = GeoBatch(geo, num_workers=int(args.nworkers))
+        results = batch.render_files(args.lists, args.directory, args.format)
+        if args.groups:
+            results += batch.render_groups(read_groups(args.groups),
+                                           args.directory, args.format)
+        for output_file, count in results:
+            print('Rendered', output_file, '({} points)'.format(count))
+        exit(0)
 
-    # Geo object instantiation
-    geo = GeoIpMap(args.iplist, args.geodb, img,
+    if args.command == 'animate':
+        print('Unpacking', geodb)
+        geo = GeoIpMap(None, geodb, img, method='raw', cache_file=args.cache,
+                       cache_prefix=args.cache_prefix,
+                       geodb6_file=geodb6, stats=stats)
+        if args.stats:
+            atexit.register(lambda: print(geo.stats.to_json(),
+                                          file=sys.stderr))
+        if args.events == '-':
+            events = read_events(sys.stdin)
+        else:
+            with open(args.events, 'rt', newline='') as f:
+                events = read_events(f)
+        if not events:
+            print("Error: no valid 'timestamp,ip' rows in '{}'; nothing "
+                  "written.".format(args.events), file=sys.stderr)
+            exit(1)
+        animation = GeoAnimation(geo, args.interval, args.fps,
+                                 num_workers=int(args.nworkers))
+        try:
+            frames = animation.render(events, args.output)
+        except RuntimeError as e:
+            print('Error: {}.'.format(e), file=sys.stderr)
+            exit(1)
+        print('Rendered', args.output, '({} frames)'.format(len(frames)))
+        exit(0)
+
+    if args.command == 'tiles':
+        print('Unpacking', geodb)
+        geo = GeoIpMap(args.iplist, geodb, img, method=arg_method,
+                       num_workers=arg_nworkers, num_splits=arg_nsplits,
+                       cache_file=args.cache,
+                       cache_prefix=args.cache_prefix, geodb6_file=geodb6,
+                       stats=stats)
+        if args.stats:
+            atexit.register(lambda: print(geo.stats.to_json(),
+                                          file=sys.stderr))
+        tiles = GeoTiles(geo, args.directory, args.max_zoom, args.min_zoom,
+                         num_workers=int(args.nworkers))
+        if args.clear:
+            tiles.clear()
+        if args.base:
+            print('Wrote {} tiles of the map'.format(len(tiles.render_base())))
+        print('Wrote {} tiles into {}'.format(
+            len(tiles.update(geo.ips, geo.ips6)), args.directory))
+        exit(0)
+
+    if args.tail:
+        if geodb6:
+            print("Error: '-T' finds only IPv4 addresses in the log; it "
+                  "cannot be used with '-6'.", file=sys.stderr)
+            exit(1)
+        print('Unpacking', geodb)
+        geo = GeoIpMap(None, geodb, img, method='raw', cache_file=args.cache,
+                       cache_prefix=args.cache_prefix,
+                       stats=stats)
+        if args.stats:
+            atexit.register(lambda: print(geo.stats.to_json(),
+                                          file=sys.stderr))
+        stream = GeoStream(geo, args.output)
+        if args.iplist == '-':
+            stream.run(sys.stdin, verbose=True)
+        else:
+            with open(args.iplist, 'rt') as f:
+                stream.run(f, follow=True, verbose=True)
+        exit(0)
+
+    if args.memory_limit and not (args.output or args.export):
+        print("Error: '-L' requires '-o' or '-e'.  Use '-h' or '--help' "
+              "for help.", file=sys.stderr)
+        exit(1)
+
+    # Geo object instantiation (with no IP list if read in chunks)
+    geo = GeoIpMap(None if args.memory_limit else args.iplist, geodb, img,
                    method=arg_method,
                    num_workers=arg_nworkers,
                    num_splits=arg_nsplits,
-                   verbose=True)
+                   verbose=args.export != '-',
+                   cache_file=args.cache,
+                   cache_prefix=args.cache_prefix,
+                   geodb6_file=geodb6, stats=stats)
+    if args.stats:
+        atexit.register(lambda: print(geo.stats.to_json(), file=sys.stderr))
+
+    if args.memory_limit:
+        bulk = GeoBulk(geo, args.memory_limit << 20)
+        iplist = sys.stdin if args.iplist == '-' else args.iplist
+        if args.export:
+            bulk.export(iplist,
+                        sys.stdout if args.export == '-' else args.export)
+        elif args.density:
+            bulk.render_density(iplist, args.output, cell_size=args.density)
+        else:
+            bulk.render(iplist, args.output)
+        exit(0)
 
     # Do the math!
+    if args.export:
+        geo.export(sys.stdout if args.export == '-' else args.export)
+        exit(0)
+
+    if args.density:
+        geo.render_density(args.output, cell_size=args.density)
+        exit(0)
+
     geo.ips_to_pixels()
-    geo.plot()
+    if args.output:
+        geo.render(args.output)
+    else:
+        geo.plot()